@@ -1,22 +1,181 @@
 #%%
 
 #import pulp
-from pulp import LpVariable, LpProblem, LpMaximize, LpStatus, value, LpMinimize, makeDict, lpSum
+from pulp import (LpVariable, LpProblem, LpMaximize, LpStatus, value, LpMinimize, makeDict, lpSum, PULP_CBC_CMD,
+                  LpStatusOptimal, LpStatusInfeasible, LpStatusUnbounded, LpStatusNotSolved, LpStatusUndefined)
 import numpy as np
+import time
+
+#%%
+# The model, built once
+
+class ExchangeModel(object):
+    """Cheapest currency exchange LP.  Built once, then minima, goals and exchange rates can be changed and re-solved"""
+    # Each scenario used to mean a new LpProblem, 25 new Flow variables, every end_* expression rebuilt and a CBC
+    # run in a subprocess.  Here the problem is built once with its constraints kept by name, and changing an
+    # input only rewrites the constraints it shows up in.
+    # If highspy is installed, solves run in-process on a HiGHS copy of the model: only the constraints that
+    # changed get pushed to it, and HiGHS starts from the last solve's basis.  Otherwise PuLP runs CBC as before
+
+    def __init__(self, currencies, start_vol, exchange, goals, minima):
+        # exchange: {from: {to: rate}}.  goals: {currency: amount in that currency}.  minima: {currency: USD}
+        self.currencies = list(currencies)
+        self.start_vol = dict(start_vol)
+        self.exchange = {f: dict(exchange[f]) for f in currencies}
+        self.goals = dict(goals)
+        self.minima = dict(minima)
+
+        # Note: we are trying to maximize the USD-denominated holdings,
+        # which minimizes the currency exchange fee
+        self.prob = LpProblem('Cheapest Currency Exchange', LpMaximize)
+        self.vars = LpVariable.dicts('Flow', (currencies, currencies), 0, None)
+
+        # Constraints.  These are the goal currencies
+        for curr in self.goals:
+            self.prob += self.end(curr) >= self.goals[curr], 'goal_' + curr
+        # Constraints.  These are the minimum currencies.  Note that the goal currencies above are more constraining for EUR/JPY than below
+        for curr in self.currencies:
+            self.prob += self.exchange[curr]['USD'] * self.end(curr) >= self.minima[curr], 'min_' + curr
+        self.prob += self.usd_total()
+
+        self.changed = set()    # Constraints (and 'objective') changed since the last HiGHS solve
+        self.highs = None
+
+    def end(self, curr):
+        # End-state currency: starting volume, less outflows in the country's currency, plus inflows exchanged
+        # from the originating currency to the country's currency
+        return lpSum(
+            [self.start_vol[curr],
+             [-1*self.vars[curr][t] for t in self.currencies],
+             [self.exchange[f][curr] * self.vars[f][curr] for f in self.currencies]
+             ])
+
+    def usd_total(self):
+        # Objective function.  This takes all of the end currency volumes and pushes them back to USD, then sums
+        return lpSum([self.exchange[curr]['USD'] * self.end(curr) for curr in self.currencies])
+
+    def rewrite(self, name, expr, rhs):
+        # New coefficients for an existing constraint, in place
+        constraint = self.prob.constraints[name]
+        constraint.expr = expr
+        constraint.changeRHS(rhs - expr.constant)
+        self.changed.add(name)
+
+    def set_minimum(self, curr, usd):
+        self.minima[curr] = usd
+        constraint = self.prob.constraints['min_' + curr]
+        constraint.changeRHS(usd - constraint.expr.constant)
+        self.changed.add('min_' + curr)
+
+    def set_goal(self, curr, amount):
+        self.goals[curr] = amount
+        constraint = self.prob.constraints['goal_' + curr]
+        constraint.changeRHS(amount - constraint.expr.constant)
+        self.changed.add('goal_' + curr)
+
+    def set_rate(self, from_curr, to_curr, rate):
+        # A rate changes the inflows to to_curr.  A rate into USD is also what from_curr's minimum and its share of
+        # the objective are converted at
+        self.exchange[from_curr][to_curr] = rate
+        for curr in {to_curr, from_curr} if to_curr == 'USD' else {to_curr}:
+            if curr in self.goals:
+                self.rewrite('goal_' + curr, self.end(curr), self.goals[curr])
+            self.rewrite('min_' + curr, self.exchange[curr]['USD'] * self.end(curr), self.minima[curr])
+        self.prob.setObjective(self.usd_total())
+        self.changed.add('objective')
+
+    def solve(self):
+        """Solve with the current inputs.  Returns the status, as LpProblem.solve does, and fills in varValue"""
+        try:
+            import highspy
+        except ImportError:
+            return self.prob.solve(PULP_CBC_CMD(msg=False))
+
+        if self.highs is None:
+            # Empty rows and columns to start with.  The first sync fills in every coefficient
+            self.highs = highspy.Highs()
+            self.highs.setOptionValue('output_flag', False)
+            self.columns = [self.vars[f][t] for f in self.currencies for t in self.currencies]
+            self.column_index = {var.name: j for j, var in enumerate(self.columns)}
+            self.row_index = {name: i for i, name in enumerate(self.prob.constraints)}
+            n, m = len(self.columns), len(self.row_index)
+            self.highs.addCols(n, np.zeros(n), np.zeros(n), np.full(n, highspy.kHighsInf), 0, [], [], [])
+            self.highs.addRows(m, np.zeros(m), np.full(m, highspy.kHighsInf), 0, [], [], [])
+            self.highs.changeObjectiveSense(highspy.ObjSense.kMaximize)
+            self.changed = set(self.row_index) | {'objective'}
+
+        for name in self.changed:
+            if name == 'objective':
+                objective = self.prob.objective
+                for j, var in enumerate(self.columns):
+                    self.highs.changeColCost(j, objective.get(var, 0))
+                self.highs.changeObjectiveOffset(objective.constant)
+            else:
+                # Every constraint is a >=, with the constant folded into the lower bound
+                i, constraint = self.row_index[name], self.prob.constraints[name]
+                for var, coefficient in constraint.expr.items():
+                    self.highs.changeCoeff(i, self.column_index[var.name], coefficient)
+                self.highs.changeRowBounds(i, -constraint.constant, highspy.kHighsInf)
+        self.changed = set()
+
+        self.highs.run()
+        model_status = self.highs.getModelStatus()
+        if model_status == highspy.HighsModelStatus.kUnknown:
+            # The warm start can leave HiGHS unable to say (e.g. once a rate change opens up an arbitrage).  Throw
+            # away the old basis and solve again from scratch
+            self.highs.clearSolver()
+            self.highs.run()
+            model_status = self.highs.getModelStatus()
+        if model_status == highspy.HighsModelStatus.kOptimal:
+            status = LpStatusOptimal
+        elif model_status == highspy.HighsModelStatus.kInfeasible:
+            status = LpStatusInfeasible
+        elif model_status == highspy.HighsModelStatus.kUnbounded:
+            status = LpStatusUnbounded
+        elif model_status == highspy.HighsModelStatus.kUnboundedOrInfeasible:
+            status = LpStatusUndefined      # One or the other, HiGHS can't tell which
+        else:
+            status = LpStatusNotSolved
+        # Only an optimal solve has a trading plan worth reading
+        values = self.highs.getSolution().col_value if status == LpStatusOptimal else [None] * len(self.columns)
+        for var, x in zip(self.columns, values):
+            var.varValue = x
+        self.prob.status = status
+        return status
 
 #%%
 # Create functions that spit out results of the model of end currencies
 
-def calcEnd(curr):
-    val = start_vol[curr]
-    for t in Currencies:
-        val = val - vars[curr][t].varValue
-    for f in Currencies:
-        val = val + Exchange[f][curr] * vars[f][curr].varValue
+def calcEnd(model, curr):
+    val = model.start_vol[curr]
+    for t in model.currencies:
+        val = val - model.vars[curr][t].varValue
+    for f in model.currencies:
+        val = val + model.exchange[f][curr] * model.vars[f][curr].varValue
     return val
 
-def printEnd(curr):
-    print (curr, "In USD:", Exchange[curr]['USD'] * calcEnd(curr), "; Original currency: ", calcEnd(curr))
+def printEnd(model, curr):
+    print (curr, "In USD:", model.exchange[curr]['USD'] * calcEnd(model, curr), "; Original currency: ", calcEnd(model, curr))
+
+def printResults(model, label, status):
+    print(label)
+
+    # No trading plan to show unless it solved (e.g. an arbitrage makes the problem unbounded)
+    if status != LpStatusOptimal:
+        print(f"status={LpStatus[status]}")
+        return
+
+    # print the results
+    for variable in model.prob.variables():
+        print(f"{variable.name} = {variable.varValue}")
+
+    print(f"Objective = {value(model.prob.objective)}")
+    print(f"")
+
+    for c in model.currencies:
+        printEnd(model, c)
+
+    print(f"status={LpStatus[status]}")
 
 
 #%%
@@ -70,88 +229,15 @@ min_JPY = 250000
 
 #%%
 
-# define the problem
-# Note: we are trying to maximize the USD-denominated holdings,
-# which minimizes the currency exchange fee
-prob1 = LpProblem('Cheapest Currency Exchange', LpMaximize)
-# Note, LpMaximize for a maximization problem,
-# and LpMinimize for a minimization problem
-
-# define variables
-
-vars = LpVariable.dicts('Flow', (Currencies, Currencies), 0, None)
-
-# Define objective Function
-# Structure of the objective function is to sum all end currencies and convert to USD
-
-# Define Interim Variables (the end-state currencies, derived by calculating starting currency and then managing in/outflows
-end_USD = lpSum(
-    [start_vol['USD'], # Starting volume
-     [-1*vars['USD'][t] for t in Currencies], # Outflows, in the country's currency
-     [Exchange[f]['USD'] * vars[f]['USD'] for f in Currencies] #Inflows, exchanged from originating currency to country's currency
-     ])
-
-end_EUR = lpSum(
-    [start_vol['EUR'], # Starting volume
-     [-1*vars['EUR'][t] for t in Currencies], # Outflows, in the country's currency
-     [Exchange[f]['EUR'] * vars[f]['EUR'] for f in Currencies] #Inflows, exchanged from originating currency to country's currency
-     ])
-
-end_GBP = lpSum(
-    [start_vol['GBP'], # Starting volume
-     [-1*vars['GBP'][t] for t in Currencies], # Outflows, in the country's currency
-     [Exchange[f]['GBP'] * vars[f]['GBP'] for f in Currencies] #Inflows, exchanged from originating currency to country's currency
-     ])
-
-end_HKD = lpSum(
-    [start_vol['HKD'], # Starting volume
-     [-1*vars['HKD'][t] for t in Currencies], # Outflows, in the country's currency
-     [Exchange[f]['HKD'] * vars[f]['HKD'] for f in Currencies] #Inflows, exchanged from originating currency to country's currency
-     ])
-
-end_JPY = lpSum(
-    [start_vol['JPY'], # Starting volume
-     [-1*vars['JPY'][t] for t in Currencies], # Outflows, in the country's currency
-     [Exchange[f]['JPY'] * vars[f]['JPY'] for f in Currencies] #Inflows, exchanged from originating currency to country's currency
-     ])
-
-# Constraints.  These are the goal currencies
-prob1 += end_EUR >= goal_EUR
-prob1 += end_JPY >= goal_JPY
-
-# Constraints.  These are the minimum currencies.  Note that the goal currencies above are more constraining for EUR/JPY than below
-prob1 += Exchange['USD']['USD'] * end_USD >= min_USD
-prob1 += Exchange['EUR']['USD'] * end_EUR >= min_EUR
-prob1 += Exchange['GBP']['USD'] * end_GBP >= min_GBP
-prob1 += Exchange['HKD']['USD'] * end_HKD >= min_HKD
-prob1 += Exchange['JPY']['USD'] * end_JPY >= min_JPY
-
-# Objective function.  This takes all of the end currency volumes and pushes them back to USD, then sums
-prob1 += lpSum([
-    [Exchange['USD']['USD'] * end_USD],
-    [Exchange['EUR']['USD'] * end_EUR],
-    [Exchange['GBP']['USD'] * end_GBP],
-    [Exchange['HKD']['USD'] * end_HKD],
-    [Exchange['JPY']['USD'] * end_JPY]
-])
-
+# define the problem.  This is the only time it gets built; the scenarios below change its inputs in place
+model = ExchangeModel(Currencies, start_vol, Exchange,
+                      goals={'EUR': goal_EUR, 'JPY': goal_JPY},
+                      minima={'USD': min_USD, 'EUR': min_EUR, 'GBP': min_GBP, 'HKD': min_HKD, 'JPY': min_JPY})
 
 # Print Results
 
-status = prob1.solve()
-print(label)
-
-# print the results
-for variable in prob1.variables():
-    print(f"{variable.name} = {variable.varValue}")
-
-print(f"Objective = {value(prob1.objective)}")
-print(f"")
-
-for c in Currencies:
-    printEnd(c)
-
-print(f"status={LpStatus[status]}")
+status = model.solve()
+printResults(model, label, status)
 
 
 
@@ -163,195 +249,48 @@ print(f"status={LpStatus[status]}")
 label = "Wk2 / HW1 Scenario 2"
 
 # Define new minima in USD:
-min_USD = 50000
-min_EUR = 50000
-min_GBP = 50000
-min_HKD = 50000
-min_JPY = 50000
-
-# define the problem
-prob1 = LpProblem('Cheapest Currency Exchange', LpMaximize)
-# Note, LpMaximize for a maximization problem,
-# and LpMinimize for a minimization problem
-
-# define variables
-
-vars = LpVariable.dicts('Flow', (Currencies, Currencies), 0, None)
-
-# Define objective Function
-# Structure of the objective function is to sum all end currencies and convert to USD
-
-
-# Define Interim Variables (the end-state currencies, derived by calculating starting currency and then managing in/outflows
-end_USD = lpSum(
-    [start_vol['USD'], # Starting volume
-     [-1*vars['USD'][t] for t in Currencies], # Outflows, in the country's currency
-     [Exchange[f]['USD'] * vars[f]['USD'] for f in Currencies] #Inflows, exchanged from originating currency to country's currency
-     ])
-
-end_EUR = lpSum(
-    [start_vol['EUR'], # Starting volume
-     [-1*vars['EUR'][t] for t in Currencies], # Outflows, in the country's currency
-     [Exchange[f]['EUR'] * vars[f]['EUR'] for f in Currencies] #Inflows, exchanged from originating currency to country's currency
-     ])
-
-end_GBP = lpSum(
-    [start_vol['GBP'], # Starting volume
-     [-1*vars['GBP'][t] for t in Currencies], # Outflows, in the country's currency
-     [Exchange[f]['GBP'] * vars[f]['GBP'] for f in Currencies] #Inflows, exchanged from originating currency to country's currency
-     ])
-
-end_HKD = lpSum(
-    [start_vol['HKD'], # Starting volume
-     [-1*vars['HKD'][t] for t in Currencies], # Outflows, in the country's currency
-     [Exchange[f]['HKD'] * vars[f]['HKD'] for f in Currencies] #Inflows, exchanged from originating currency to country's currency
-     ])
-
-end_JPY = lpSum(
-    [start_vol['JPY'], # Starting volume
-     [-1*vars['JPY'][t] for t in Currencies], # Outflows, in the country's currency
-     [Exchange[f]['JPY'] * vars[f]['JPY'] for f in Currencies] #Inflows, exchanged from originating currency to country's currency
-     ])
-
-# Constraints.  These are the goal currencies
-prob1 += end_EUR >= goal_EUR
-prob1 += end_JPY >= goal_JPY
-
-# Constraints.  These are the minimum currencies.  Note that the goal currencies above are more constraining for EUR/JPY than below
-prob1 += Exchange['USD']['USD'] * end_USD >= min_USD
-prob1 += Exchange['EUR']['USD'] * end_EUR >= min_EUR
-prob1 += Exchange['GBP']['USD'] * end_GBP >= min_GBP
-prob1 += Exchange['HKD']['USD'] * end_HKD >= min_HKD
-prob1 += Exchange['JPY']['USD'] * end_JPY >= min_JPY
-
-# Objective function.  This takes all of the end currency volumes and pushes them back to USD, then sums
-prob1 += lpSum([
-    [Exchange['USD']['USD'] * end_USD],
-    [Exchange['EUR']['USD'] * end_EUR],
-    [Exchange['GBP']['USD'] * end_GBP],
-    [Exchange['HKD']['USD'] * end_HKD],
-    [Exchange['JPY']['USD'] * end_JPY]
-])
-
+for c in Currencies:
+    model.set_minimum(c, 50000)
 
 # Print Results
 
-status = prob1.solve()
-print(label)
-
-# print the results
-for variable in prob1.variables():
-    print(f"{variable.name} = {variable.varValue}")
-
-print(f"Objective = {value(prob1.objective)}")
-print(f"")
-
-for c in Currencies:
-    printEnd(c)
-
-print(f"status={LpStatus[status]}")
+status = model.solve()
+printResults(model, label, status)
 
 #%%
 
 # Part 5:
 
-exch_df = [# To Currency
-    # USD       EUR         GBP         HKD         JPY
-    [1,        1.01864,    0.6414,     7.7985,     118.55],  # From USD
-    [0.9724,   1,          0.6295,     7.6552,     116.41],  # From EUR
-    [1.5593,   1.5881,     1,          12.154,     184.97],  # From GBP
-    [0.12812,  0.1304,     0.0821,     1,          15.1005], # From HKD
-    [0.00843,  0.00856,    0.0054,     0.0658,     1],       # From JPY
-]
-Exchange = makeDict([Currencies, Currencies], exch_df, 0)
+# USD --> GBP goes from 0.6409 to 0.6414
+model.set_rate('USD', 'GBP', 0.6414)
 
 # Reset minima to the original $250k (note: this doesn't matter, given the problem introduced above but c'est la vie):
-min_USD = 250000
-min_EUR = 250000
-min_GBP = 250000
-min_HKD = 250000
-min_JPY = 250000
+for c in Currencies:
+    model.set_minimum(c, 250000)
 
 label = "Week 2 / HW 1 Scenario 5"
 
-# define the problem
-prob1 = LpProblem('Cheapest Currency Exchange', LpMaximize)
-# Note, LpMaximize for a maximization problem,
-# and LpMinimize for a minimization problem
-
-# define variables
-
-vars = LpVariable.dicts('Flow', (Currencies, Currencies), 0, None)
-
-# Define objective Function
-# Structure of the objective function is to sum all end currencies and convert to USD
-
-
-# Define Interim Variables (the end-state currencies, derived by calculating starting currency and then managing in/outflows
-end_USD = lpSum(
-    [start_vol['USD'], # Starting volume
-     [-1*vars['USD'][t] for t in Currencies], # Outflows, in the country's currency
-     [Exchange[f]['USD'] * vars[f]['USD'] for f in Currencies] #Inflows, exchanged from originating currency to country's currency
-     ])
-
-end_EUR = lpSum(
-    [start_vol['EUR'], # Starting volume
-     [-1*vars['EUR'][t] for t in Currencies], # Outflows, in the country's currency
-     [Exchange[f]['EUR'] * vars[f]['EUR'] for f in Currencies] #Inflows, exchanged from originating currency to country's currency
-     ])
-
-end_GBP = lpSum(
-    [start_vol['GBP'], # Starting volume
-     [-1*vars['GBP'][t] for t in Currencies], # Outflows, in the country's currency
-     [Exchange[f]['GBP'] * vars[f]['GBP'] for f in Currencies] #Inflows, exchanged from originating currency to country's currency
-     ])
-
-end_HKD = lpSum(
-    [start_vol['HKD'], # Starting volume
-     [-1*vars['HKD'][t] for t in Currencies], # Outflows, in the country's currency
-     [Exchange[f]['HKD'] * vars[f]['HKD'] for f in Currencies] #Inflows, exchanged from originating currency to country's currency
-     ])
-
-end_JPY = lpSum(
-    [start_vol['JPY'], # Starting volume
-     [-1*vars['JPY'][t] for t in Currencies], # Outflows, in the country's currency
-     [Exchange[f]['JPY'] * vars[f]['JPY'] for f in Currencies] #Inflows, exchanged from originating currency to country's currency
-     ])
-
-# Constraints.  These are the goal currencies
-prob1 += end_EUR >= goal_EUR
-prob1 += end_JPY >= goal_JPY
-
-# Constraints.  These are the minimum currencies.  Note that the goal currencies above are more constraining for EUR/JPY than below
-prob1 += Exchange['USD']['USD'] * end_USD >= min_USD
-prob1 += Exchange['EUR']['USD'] * end_EUR >= min_EUR
-prob1 += Exchange['GBP']['USD'] * end_GBP >= min_GBP
-prob1 += Exchange['HKD']['USD'] * end_HKD >= min_HKD
-prob1 += Exchange['JPY']['USD'] * end_JPY >= min_JPY
-
-# Objective function.  This takes all of the end currency volumes and pushes them back to USD, then sums
-prob1 += lpSum([
-    [Exchange['USD']['USD'] * end_USD],
-    [Exchange['EUR']['USD'] * end_EUR],
-    [Exchange['GBP']['USD'] * end_GBP],
-    [Exchange['HKD']['USD'] * end_HKD],
-    [Exchange['JPY']['USD'] * end_JPY]
-])
-
-
 # Print Results
 
-status = prob1.solve()
-print(label)
-
-# print the results
-for variable in prob1.variables():
-    print(f"{variable.name} = {variable.varValue}")
-
-print(f"Objective = {value(prob1.objective)}")
-print(f"")
+status = model.solve()
+printResults(model, label, status)
 
-for c in Currencies:
-    printEnd(c)
+#%%
 
-print(f"status={LpStatus[status]}")
\ No newline at end of file
+# Streaming rate updates: nudge a random exchange rate by a tiny amount and re-solve, STREAM_UPDATES times, to
+# see how many re-solves a minute the model keeps up with.  0 = skip
+STREAM_UPDATES = 0 # e.g. 5000
+
+if STREAM_UPDATES:
+    model.set_rate('USD', 'GBP', 0.6409)
+    rng = np.random.default_rng(460)
+    statuses = []
+    started = time.perf_counter()
+    for i in range(STREAM_UPDATES):
+        f, t = Pairs[rng.integers(len(Pairs))]
+        if f != t:
+            model.set_rate(f, t, Exchange[f][t] * (1 + rng.normal(0, 1e-5)))
+        statuses.append(LpStatus[model.solve()])
+    elapsed = time.perf_counter() - started
+    print(f"{STREAM_UPDATES} re-solves in {elapsed:.2f}s ({60 * STREAM_UPDATES / elapsed:.0f} a minute)")
+    print({s: statuses.count(s) for s in set(statuses)})
@@ -0,0 +1,83 @@
+import collections
+import os
+import numpy as np
+import pandas as pd
+from staffing_simulation import worker_context
+
+# Reporting for west-assignment-5.py
+# summarize_results works out every histogram and summary quantile for a run's results_array from one
+# (iterations x fields) array, instead of one DataFrame and one .plot.hist per output.  The counts and bin
+# edges are all a figure needs, so ReportWorker draws and saves the figures in separate processes (with the
+# non-interactive Agg backend) while the script gets on with the next scenario.
+
+REPORT_QUANTILES = (0.05, 0.25, 0.5, 0.75, 0.95)
+
+# histograms: {field: (counts, bin edges)}, as np.histogram gives them
+# quantiles: one row per field: mean, then one column per quantile (P5, P25, ...)
+ResultSummary = collections.namedtuple('ResultSummary', ['histograms', 'quantiles'])
+
+
+def summarize_results(records, fields, bins=10, quantiles=REPORT_QUANTILES):
+    """Histogram and quantiles of each field of a record array"""
+    values = np.column_stack([records[field] for field in fields]).astype(float)
+    # np.histogram is what pandas .plot.hist bins with, so these are the bins the old figures had
+    histograms = {field: np.histogram(values[:, i], bins) for i, field in enumerate(fields)}
+    table = pd.DataFrame(np.quantile(values, quantiles, axis=0).T, index=pd.Index(fields, name='field'),
+                         columns=['P%g' % (100 * q) for q in quantiles])
+    table.insert(0, 'mean', values.mean(axis=0))
+    return ResultSummary(histograms, table)
+
+
+def render_histograms(histograms, titles, filenames):
+    """Draw and save a density histogram for each field in titles.  Runs in the report worker"""
+    # Agg draws straight to the PNG, so nothing here needs (or waits on) a display
+    import matplotlib
+    matplotlib.use('Agg', force=True)
+    import matplotlib.pyplot as plt
+    for field, title in titles.items():
+        counts, edges = histograms[field]
+        fig, ax = plt.subplots()
+        ax.hist(edges[:-1], bins=edges, weights=counts, density=True, alpha=0.6, color='b')
+        ax.set_ylabel('Frequency')
+        ax.set_title(title)
+        fig.savefig(filenames[field])
+        plt.close(fig)
+    return list(filenames.values())
+
+
+class ReportWorker(object):
+    """Background processes that render figures while the script gets on with the next scenario"""
+    # One plain process per set of figures.  A ProcessPoolExecutor would start a management thread in this
+    # process, and any pool forked after it (run_sweep, find_min_team_size, run_teams) would fork with that
+    # thread alive.  Processes started here leave no threads behind.
+    # Without fork (e.g. Windows) a new process would re-run the calling script, which has no __main__ guard, so
+    # there the figures are drawn in-process as each set is submitted
+
+    def __init__(self, max_running=None):
+        self.context = worker_context()
+        self.max_running = max_running or os.cpu_count() or 1
+        self.processes = []
+        self.filenames = []
+
+    def submit(self, histograms, titles, filenames):
+        """Start drawing a set of histograms.  Returns straight away unless max_running sets are still drawing"""
+        self.filenames.extend(filenames.values())
+        if self.context is None:
+            render_histograms(histograms, titles, filenames)
+            return
+        running = [process for process in self.processes if process.exitcode is None]
+        if len(running) >= self.max_running:
+            running[0].join()
+        process = self.context.Process(target=render_histograms, args=(histograms, titles, filenames))
+        process.start()
+        self.processes.append(process)
+
+    def close(self):
+        """Wait for every figure to be written.  Returns the file names; raises if any set failed to draw"""
+        for process in self.processes:
+            process.join()
+        failed = [process.exitcode for process in self.processes if process.exitcode != 0]
+        if failed:
+            # The worker's own traceback has already gone to stderr
+            raise RuntimeError('%d of %d figure sets failed to draw' % (len(failed), len(self.processes)))
+        return self.filenames
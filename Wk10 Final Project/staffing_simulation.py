@@ -0,0 +1,1596 @@
+import collections
+import heapq
+import itertools
+import json
+import multiprocessing
+import os
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from functools import lru_cache
+from statistics import NormalDist, mean
+import numpy as np
+import pandas as pd
+import simpy
+
+# Re-entrant version of the modeling team staffing simulation in west-assignment-5.py
+# Everything one simulation needs (env, the modeler_beach resource, counters and reporting series) lives on a
+# StaffingSimulation object instead of in module globals, so any number of simulations can exist at once
+# (threads, processes, or embedded in another service).  The model itself is unchanged.
+# Nothing runs as a once-a-week SimPy process any more: quits are sampled up front as gaps between quit weeks,
+# and the reporting series are only written when staffing or a counter actually changes.
+# Each Model keeps a table of the tasks it has coming up and only starts a task's process once its window opens,
+# so the number of live processes stays flat however long the run and however many models there are.
+# run_iterations farms the iterations of one scenario out to a process pool, and run_sweep does the same for a
+# whole grid of scenarios at once.  run_until_precise keeps adding batches of iterations until the confidence
+# intervals of the outputs you care about are as tight as asked for.  Give either farm a ResultStore to save
+# each iteration's results to SQLite as it goes and resume from there after an interruption.
+# FastStaffingSimulation runs the same model on a small event calendar of its own instead of SimPy: same
+# results for the same seed, a good deal faster.  Pick it with engine='fast'; SimPy stays the reference.
+# LockstepStaffing (engine='lockstep') steps every iteration of a scenario forward together, week by week, on
+# NumPy arrays.  It draws its own random numbers, so it matches the other engines in distribution only.
+# MultiTeamSimulation (run_teams) runs several teams side by side, each with its own modelers and models, hiring
+# through one shared recruiting team and optionally borrowing idle modelers from each other.
+# find_min_team_size bisects on team size for the smallest team that meets a service target (e.g. P95
+# failed_monitor_pct <= 5%), only running more iterations for the team sizes that are too close to call.
+# Pass a SimulationTrace to StaffingSimulation to see where a run spends its events and time.  Without one the
+# simulation runs on a plain simpy Environment and pays nothing for it.
+
+# Inputs into the system.  Field names mirror the constants in the script
+StaffingParams = collections.namedtuple('StaffingParams', [
+    'duration',                     # Weeks (DURATION)
+    'modeler_target_team_size',     # MODELER_TARGET_TEAM_SIZE
+    'modeler_start_team_size',      # MODELER_START_TEAM_SIZE
+    'hiring_mean',                  # HIRING_MEAN.  Weeks on average to find a new hire
+    'hiring_sdev',                  # HIRING_SDEV
+    'quitting_mean',                # QUITTING_MEAN.  Weeks on average until someone quits
+    'quitting_sdev',                # QUITTING_SDEV
+    'models_total',                 # MODELS_TOTAL
+    'model_build_min_weeks',        # MODEL_BUILD_MIN_WEEKS
+    'model_build_max_weeks',        # MODEL_BUILD_MAX_WEEKS
+    'model_monitor_min_weeks',      # MODEL_MONITOR_MIN_WEEKS
+    'model_monitor_max_weeks',      # MODEL_MONITOR_MAX_WEEKS
+])
+
+# What one iteration reports.  results_array turns a run's worth into one column per field
+StaffingResult = collections.namedtuple('StaffingResult', [
+    'hired',
+    'fired',
+    'failed_rebuilds',
+    'failed_monitors',
+    'failed_monitor_pct',
+    'end_period',                   # Week all models were first built (DURATION if never)
+    'capacity',                     # Avg available FTE once all models were built
+])
+
+# Column types for results_array
+RESULT_DTYPE = np.dtype([('hired', np.int32), ('fired', np.int32), ('failed_rebuilds', np.int32),
+                         ('failed_monitors', np.int32), ('failed_monitor_pct', np.float64),
+                         ('end_period', np.int32), ('capacity', np.float64)])
+
+# What run_until_precise reports: the StaffingResults, each target field's CI half-width, and whether every
+# target was met before running out of iterations
+SequentialRun = collections.namedtuple('SequentialRun', ['results', 'half_widths', 'converged'])
+
+# Set up the priorities for different tasks to track
+priority_hire = 0
+priority_fire = 0
+priority_build = 3
+priority_monitor = 2
+priority_rebuild = 1
+
+#%%
+
+# Random numbers
+
+class RandomPool(object):
+    """Pre-drawn random numbers for one simulation, refilled in blocks from a numpy Generator"""
+    # A scalar rng.normal or rng.uniform call is mostly numpy call overhead, so draw block_size standard normals
+    # (or uniforms) at a time and hand them out one by one.  normal() and uniform() take the same arguments as
+    # the Generator methods, so the helpers below work with either
+
+    def __init__(self, seed=None, block_size=1024):
+        # seed is anything np.random.default_rng accepts, e.g. one iteration's SeedSequence
+        self.generator = np.random.default_rng(seed)
+        self.block_size = block_size
+        self.normals = []
+        self.uniforms = []
+
+    def normal(self, mean=0.0, stdev=1.0):
+        if not self.normals:
+            self.normals = self.generator.standard_normal(self.block_size).tolist()
+        return mean + stdev * self.normals.pop()
+
+    def uniform(self, low=0.0, high=1.0):
+        if not self.uniforms:
+            self.uniforms = self.generator.random(self.block_size).tolist()
+        return low + (high - low) * self.uniforms.pop()
+
+#%%
+
+# Control functions
+
+def test_normal(rng, mean, stdev):
+    # The function below generates a normal distribution, then takes the inverse, then runs a random check
+    # to see if a uniform number from 0-1 is below the value.
+    # This allows for us to identify, e.g., that there is an 8-week average time for an event to occur...
+    # So is THIS the week that will trigger?
+
+    normal_value = rng.normal(mean, stdev)
+    inverse_value = 1 / normal_value
+    uniform = rng.uniform(0,1)
+    if uniform < inverse_value:
+        return True
+    else:
+        return False
+
+def sample_uniform(rng, min, max):
+    # This function takes in a min and max range and spits out a random selection
+    # The +/- 0.5 is to ensure equal representation for the endcap values
+    return round(rng.uniform(min-0.5, max+0.5),0)
+
+def target_quarter(today, num_quarters_from_now):
+    # Function takes in the current week number and spits out the start of a future quarter
+    days_into_quarter = today % 13
+    target_date = today - days_into_quarter + num_quarters_from_now * 13 + 1
+    return(target_date)
+
+def weeks_until_target_quarter(today, num_quarters_from_now):
+    target_week = target_quarter(today, num_quarters_from_now)
+    return(target_week - today)
+
+@lru_cache(maxsize=None)
+def weekly_quit_probability(mean, stdev):
+    """Chance that test_normal(rng, mean, stdev) comes up True in any one week"""
+    # test_normal is True when U < 1/X for X ~ Normal(mean, stdev), so the weekly chance is E[clip(1/X, 0, 1)].
+    # Numerically integrate over +/- 12 sdev (X <= 0 never fires, 0 < X <= 1 always does)
+    x, dx = np.linspace(mean - 12 * stdev, mean + 12 * stdev, 400001, retstep=True)
+    density = np.exp(-0.5 * ((x - mean) / stdev) ** 2) / (stdev * np.sqrt(2 * np.pi))
+    with np.errstate(divide='ignore'):
+        chance = np.clip(1 / x, 0, 1)
+    return float(np.sum(chance * density) * dx)
+
+def quit_weeks(rng, p, duration):
+    """Weeks (0 to duration-1) in which someone quits, for an independent weekly quit chance of p"""
+    # Weeks between quits are geometric.  Week 0 gets tested too, so the first quit is one draw minus one week in
+    if p <= 0:
+        return []
+    weeks = np.cumsum(rng.geometric(p, int(duration * p * 2) + 10)) - 1
+    while weeks[-1] < duration:
+        weeks = np.concatenate([weeks, weeks[-1] + np.cumsum(rng.geometric(p, int(duration * p) + 10))])
+    return weeks[weeks < duration].tolist()
+
+#%%
+
+class StaffingSimulation(object):
+    """One staffing simulation: its own env, modeler_beach resource, counters and weekly reporting series"""
+
+    def __init__(self, trace=None):
+        # trace: optional SimulationTrace to record this simulation's processes and modeler_beach queue into
+        self.trace = trace
+
+    def run(self, seed, params):
+        """Run one DURATION-week simulation and return its StaffingResult"""
+        # seed is anything np.random.default_rng accepts (int, SeedSequence or an existing Generator).
+        # All the scalar draws come out of the simulation's own RandomPool
+        self.params = params
+        self.rng = RandomPool(seed)
+
+        # Setup counters etc
+        # Reporting Metrics
+        self.counter_fired = 0
+        self.counter_hired = 0
+        self.counter_failed_rebuilds = 0
+        self.counter_failed_monitors = 0
+        self.counter_models_completed = 0
+
+        # Piecewise-constant reporting series: one (week, phase, busy modelers, hired, fired, models completed)
+        # row every time one of them changes.  weekly_series turns it back into one value per week
+        self.ds_changes = [(0, 0, 0, 0, 0, 0)]
+        self.reported_week = None
+
+        # Whether someone quits is an independent test_normal check every week, so the weeks between quits are
+        # geometric: draw all the quit weeks up front instead of running the check every week
+        p_quit = weekly_quit_probability(params.quitting_mean, params.quitting_sdev)
+        self.quit_weeks = set(quit_weeks(self.rng.generator, p_quit, params.duration))
+
+        # Run environment
+        self.env = simpy.Environment() if self.trace is None else TracingEnvironment(self.trace)
+        self.modeler_beach = ModelerBeach(self, capacity = params.modeler_target_team_size)
+        if self.trace is not None:
+            self.trace.resource = self.modeler_beach
+        self.env.process(self.setup_staff())
+        self.every_week(self.staff_management)
+        self.every_week(self.weekly_reporting)
+        self.models = [Model(self, 'Model %d' % i) for i in range(1, params.models_total+1)]
+        self.env.run(until=params.duration)
+        if self.trace is not None:
+            self.trace.end_week = self.env.now
+        return self.result()
+
+    def result(self):
+        # Report results
+        params = self.params
+        series = self.weekly_series()
+        all_built = np.flatnonzero(series['models_completed'] == params.models_total)
+        self.time_models_completed = int(all_built[0]) if len(all_built) else params.duration
+
+        # Available FTE in every week from the one all models were built to the end.  The leading 0 is the
+        # starting value of the old ds_available_modelers_at_full_modeling list, kept so capacity is unchanged
+        available_at_full_modeling = series['available_modelers'][self.time_models_completed:]
+        avg_capacity_at_full_modeling = round(mean([0] + available_at_full_modeling.tolist()),3)
+
+        monitor_attempts = params.models_total * ((params.duration / 52) - 1) * 4
+        failed_monitor_percentage = round(self.counter_failed_monitors / monitor_attempts,2)
+
+        return StaffingResult(self.counter_hired, self.counter_fired, self.counter_failed_rebuilds,
+                              self.counter_failed_monitors, failed_monitor_percentage, self.time_models_completed,
+                              avg_capacity_at_full_modeling)
+
+    def record_change(self):
+        # Changes made after that week's report only show up the week after: phase is 0 before the report and
+        # 1 after it, so rows stay in (week, phase) order
+        phase = 1 if self.reported_week == self.env.now else 0
+        self.ds_changes.append((self.env.now, phase, self.modeler_beach.count, self.counter_hired,
+                                self.counter_fired, self.counter_models_completed))
+
+    def weekly_series(self, weeks=None):
+        """Reporting series as one value per week (default every week of the run), read off the change log"""
+        # Each week's report sees every change logged up to (week, 0): everything before it, and that week's
+        # changes from before the report.  (week, phase) pairs sort the same as week * 2 + phase
+        if weeks is None:
+            weeks = np.arange(self.params.duration)
+        changes = np.array(self.ds_changes)
+        order = changes[:, 0] * 2 + changes[:, 1]
+        rows = changes[np.searchsorted(order, np.asarray(weeks) * 2, side='right') - 1]
+        return {
+            'available_modelers': self.params.modeler_target_team_size - rows[:, 2].astype(int),
+            'hired': rows[:, 3].astype(int),
+            'fired': rows[:, 4].astype(int),
+            'models_completed': rows[:, 5].astype(int),
+        }
+
+    def setup_staff(self):
+        # We have a certain number of modelers as resources, with the resource volume defined as target team size
+        # However, when we start our simulation we aren't at target team size
+        # So we do this initial setup to essentially "fire" all of the excess employees
+        num_modelers_to_fire = self.params.modeler_target_team_size - self.params.modeler_start_team_size
+        for i in range(num_modelers_to_fire):
+            self.env.process(self.fire_staff())
+        yield self.env.timeout(0)
+
+    def fire_staff(self):
+        with self.modeler_beach.request(priority=priority_fire) as req:
+            yield req
+            self.counter_fired = self.counter_fired + 1
+            self.record_change()
+            weeks_remaining = max(1,round(self.rng.normal(self.params.hiring_mean, self.params.hiring_sdev),0))
+            # Note: we use the hiring mean/sdev because that's the time necessary to hire a fired employee
+            yield self.env.timeout(weeks_remaining)
+            self.counter_hired = self.counter_hired + 1
+            self.record_change()
+
+    def every_week(self, callback):
+        # staff_management and weekly_reporting used to be processes looping on timeout(1), and what they did
+        # depended on where their wake-up sat among that week's other events (who gets a modeler freed up that
+        # week, whether the report sees a change).  Chaining plain timeout callbacks keeps exactly the same
+        # place in the event queue without resuming a generator every week
+        def tick(event):
+            callback(self.env.now)
+            self.env.timeout(1).callbacks.append(tick)
+
+        def start():
+            tick(None)
+            yield self.env.event()  # Never fires.  The process only exists to run week 0 where it used to
+        self.env.process(start())
+
+    def staff_management(self, week):
+        # This process controls the quitting of modeling staff; hiring a replacement is part of fire_staff
+        if week in self.quit_weeks:
+            self.env.process(self.fire_staff())
+
+    def weekly_reporting(self, week):
+        # Changes logged from here on in the week only show up in the following week's report (record_change)
+        self.reported_week = week
+
+
+class ModelerBeach(simpy.PriorityResource):
+    """modeler_beach: a PriorityResource that logs a reporting row whenever a modeler is taken or freed"""
+    # _do_put grants a request and _do_get releases one.  A row only goes in when the busy count actually moves:
+    # processes release their request twice (yield release, then leaving the with block), and the second one
+    # frees nothing
+
+    def __init__(self, sim, capacity):
+        super().__init__(sim.env, capacity)
+        self.sim = sim
+
+    def _do_put(self, event):
+        busy = self.count
+        proceed = super()._do_put(event)
+        if self.count != busy:
+            self.sim.record_change()
+        return proceed
+
+    def _do_get(self, event):
+        busy = self.count
+        proceed = super()._do_get(event)
+        if self.count != busy:
+            self.sim.record_change()
+        return proceed
+
+
+# One task in a model's lifecycle: 'build', 'rebuild' or 'monitor', the week it can start after and the week it
+# has to have started by, less the longest the work can take.  Monitors' weeks are only filled in when they come up
+ModelTask = collections.namedtuple('ModelTask', ['kind', 'start_after', 'start_by', 'priority'])
+
+
+class Model(object):
+    """One model's lifecycle: its build, then six monitors and a rebuild, then six monitors and a rebuild, ..."""
+    # The tasks still to come wait in self.pending.  A task only gets a process once the one before it is done
+    # and its window has opened, and no process waits on another, so however long the run is each model has at
+    # most one task process and one pending window on the go.
+    # Builds used to run their monitors and the rebuild as child processes, from inside their with block.  So
+    # a build only left it (releasing its request a second time, which gives the queue a look in) when the
+    # whole chain under it was done, i.e. when a rebuild failed.  open_builds keeps those releases where they
+    # were, so a seed gives the same results as it always has (and as FastStaffingSimulation)
+    def __init__(self, sim, name):
+        self.sim = sim
+        self.env = sim.env
+        self.name = name
+        self.pending = collections.deque()
+        self.open_builds = 0
+        self.last_request = None
+
+        self.schedule(ModelTask('build', 5, sim.params.duration, priority_build))
+
+    def schedule(self, task):
+        # The time allowed is worked out now, when the task comes up, but only counts from the request
+        env, params = self.env, self.sim.params
+        max_weeks = params.model_monitor_max_weeks if task.kind == 'monitor' else params.model_build_max_weeks
+        weeks_until_deadline = max(0, task.start_by - env.now - max_weeks)
+        window = env.timeout(max(0, task.start_after - env.now))
+        window.callbacks.append(lambda event: self.start(task, weeks_until_deadline))
+
+    def start(self, task, weeks_until_deadline):
+        # The task's window has opened
+        if task.kind == 'monitor':
+            process = self.env.process(self.monitor_model(self.name, weeks_until_deadline, task.priority))
+        else:
+            process = self.env.process(self.build_model(self.name, task.kind, weeks_until_deadline, task.priority))
+        process.callbacks.append(self.task_done)
+
+    def task_done(self, process):
+        # A build that got done has already moved on to its monitors
+        if not process.value:
+            self.next_task()
+
+    def next_task(self, event=None):
+        if self.pending:
+            task = self.pending.popleft()
+            if task.kind == 'monitor':
+                # Monitors run in the quarter after the task before them finished
+                task = task._replace(start_after=target_quarter(self.env.now, 1),
+                                     start_by=target_quarter(self.env.now, 2))
+            self.schedule(task)
+        elif self.open_builds:
+            # A rebuild failed and the chain is over: the builds above it leave their with blocks, one at a time
+            self.open_builds -= 1
+            self.sim.modeler_beach.release(self.last_request)
+            self.env.timeout(0).callbacks.append(self.next_task)
+
+    def build_model(self, name, build_or_rebuild, weeks_until_deadline, given_priority):
+        # Name is self-evident.  It's the model number
+        # Build or rebuild is just a text field to help with reporting.  Has no impact on anything
+        # weeks_until_deadline is how long the request can wait for a modeler before the build fails
+        # Given Priority is a variable set earlier.  Build is lowest priority, then monitor, then rebuild
+        # Returns True if the model got built (and its monitors are under way)
+        sim, env, params = self.sim, self.env, self.sim.params
+        req = sim.modeler_beach.request(priority=given_priority)
+        results = yield req | env.timeout(weeks_until_deadline)
+        if req not in results:
+            sim.counter_failed_rebuilds += 1
+            # Leave the with block: out of the queue, and release
+            req.cancel()
+            sim.modeler_beach.release(req)
+            return False
+
+        model_build_weeks = sample_uniform(sim.rng, params.model_build_min_weeks, params.model_build_max_weeks)
+        yield env.timeout(model_build_weeks)
+        yield sim.modeler_beach.release(req)
+        self.open_builds += 1
+        self.last_request = req
+        # If this was a build (and not a rebuild), increment the models active counter
+        if build_or_rebuild == 'build':
+            sim.counter_models_completed += 1
+            sim.record_change()
+        # Next set of code sets up rebuilding the model
+        # Rebuilding the model builds a number of follow-up events:
+        #   1. Six Monitor Models steps, which need to start in each of the following quarters and end by quarter-end
+        #   2. A Rebuild Model step, which can start 6 quarters from now and needs to end by 12 quarters from now
+        s_delay = 6
+        e_delay = 12
+        # 2a. If the model is finished in, say, quarter 3, then new model can start being worked on
+        #     at the beginning of quarter 10 and must be finished by the start of quarter 16
+        rebuild_start_after = target_quarter(env.now,s_delay + 1)
+        rebuild_finish_by = target_quarter(env.now, e_delay + 1)
+        self.pending.extend([ModelTask('monitor', None, None, priority_monitor)] * s_delay)
+        self.pending.append(ModelTask('rebuild', rebuild_start_after, rebuild_finish_by, priority_rebuild))
+        self.next_task()
+        return True
+
+    def monitor_model(self, name, weeks_until_deadline, given_priority):
+        # Monitor model doesn't carry the baggage of triggering follow-on events
+        # So the drivers are very similar to what we see in the build model world
+        sim, env, params = self.sim, self.env, self.sim.params
+        with sim.modeler_beach.request(priority=given_priority) as req:
+            results = yield req | env.timeout(weeks_until_deadline)
+            if req in results:
+                model_monitor_weeks = sample_uniform(sim.rng, params.model_monitor_min_weeks, params.model_monitor_max_weeks)
+                yield env.timeout(model_monitor_weeks)
+                yield sim.modeler_beach.release(req)
+
+            else:
+                sim.counter_failed_monitors += 1
+
+
+#%%
+
+# Fast engine
+
+# Same priorities simpy gives its events: process start-ups go ahead of everything else due that week
+URGENT = 0
+NORMAL = 1
+
+class Calendar(object):
+    """Event calendar for FastStaffingSimulation: a heap of (week, priority, sequence, action, task)"""
+    __slots__ = ('now', 'queue', 'sequence')
+
+    def __init__(self):
+        self.now = 0
+        self.queue = []
+        self.sequence = itertools.count()
+
+    def schedule(self, delay, priority, action, task):
+        # The sequence number plays the part of simpy's event id: ties go to whatever was scheduled first
+        heapq.heappush(self.queue, (self.now + delay, priority, next(self.sequence), action, task))
+
+    def run(self, until):
+        queue = self.queue
+        while queue and queue[0][0] < until:
+            self.now, _, _, action, task = heapq.heappop(queue)
+            action(task)
+
+
+class ModelerPool(object):
+    """modeler_beach for FastStaffingSimulation: busy count plus the waiting requests, best first"""
+    __slots__ = ('capacity', 'count', 'waiting', 'sequence')
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.count = 0
+        self.waiting = []   # Heap of (priority, week requested, sequence, task), same order as simpy's queue
+        self.sequence = itertools.count()
+
+
+class Task(object):
+    """One build, rebuild, monitor or fire process and the simpy events it is waiting on"""
+    __slots__ = ('kind', 'priority', 'start_after', 'start_by', 'deadline', 'parent', 'waiting', 'granted',
+                 'request_done', 'condition_done', 'monitors', 'rebuild_after', 'rebuild_by', 'rebuild_started')
+
+    def __init__(self, kind, priority, start_after=0, start_by=0, parent=None):
+        self.kind = kind
+        self.priority = priority
+        self.start_after = start_after
+        self.start_by = start_by
+        self.parent = parent
+        self.waiting = False            # In the modeler_beach queue
+        self.granted = False            # Holding a modeler
+        self.request_done = False       # Request event processed
+        self.condition_done = False     # req | timeout(deadline) has fired
+        self.monitors = 0
+        self.rebuild_started = False
+
+
+class FastStaffingSimulation(StaffingSimulation):
+    """StaffingSimulation on a small purpose-built event calendar instead of simpy"""
+    # Every process in the simpy version becomes a Task, and every point where one of its generators would
+    # resume becomes an action on the calendar.  What each process does is unchanged, and so is the order
+    # things happen in within a week: each simpy event that does anything (process start-ups, timeouts, request,
+    # release and condition events, child processes finishing) is scheduled here at the same point, with the
+    # same priority.  Events nothing waits on are left out; that can't change the order of the rest.
+    # With the same seed it gives exactly the same results and weekly series as the simpy version
+
+    def run(self, seed, params):
+        """Run one DURATION-week simulation and return its StaffingResult"""
+        self.params = params
+        self.rng = RandomPool(seed)
+
+        self.counter_fired = 0
+        self.counter_hired = 0
+        self.counter_failed_rebuilds = 0
+        self.counter_failed_monitors = 0
+        self.counter_models_completed = 0
+        self.ds_changes = [(0, 0, 0, 0, 0, 0)]
+        self.reported_week = None
+
+        p_quit = weekly_quit_probability(params.quitting_mean, params.quitting_sdev)
+        self.quit_weeks = set(quit_weeks(self.rng.generator, p_quit, params.duration))
+
+        # Processes start in the same order as in StaffingSimulation.run
+        self.env = Calendar()
+        self.modeler_beach = ModelerPool(params.modeler_target_team_size)
+        self.env.schedule(0, URGENT, self.setup_staff, None)
+        self.env.schedule(0, URGENT, self.weekly_tick, self.staff_management)
+        self.env.schedule(0, URGENT, self.weekly_tick, self.weekly_reporting)
+        for i in range(params.models_total):
+            self.env.schedule(0, URGENT, self.task_start, Task('build', priority_build, 5, params.duration))
+        self.env.run(params.duration)
+        return self.result()
+
+    def weekly_tick(self, callback):
+        callback(self.env.now)
+        self.env.schedule(1, NORMAL, self.weekly_tick, callback)
+
+    def setup_staff(self, task):
+        num_modelers_to_fire = self.params.modeler_target_team_size - self.params.modeler_start_team_size
+        for i in range(num_modelers_to_fire):
+            self.env.schedule(0, URGENT, self.request, Task('fire', priority_fire))
+
+    def staff_management(self, week):
+        if week in self.quit_weeks:
+            self.env.schedule(0, URGENT, self.request, Task('fire', priority_fire))
+
+    # modeler_beach
+
+    def request(self, task):
+        pool = self.modeler_beach
+        task.waiting = True
+        heapq.heappush(pool.waiting, (task.priority, self.env.now, next(pool.sequence), task))
+        self.trigger_put()
+
+    def trigger_put(self, task=None):
+        # Like simpy, only the request at the head of the queue is looked at, and at most one gets a modeler
+        pool = self.modeler_beach
+        waiting = pool.waiting
+        while waiting and not waiting[0][3].waiting:
+            heapq.heappop(waiting)   # Cancelled while waiting
+        if waiting and pool.count < pool.capacity:
+            task = heapq.heappop(waiting)[3]
+            task.waiting = False
+            task.granted = True
+            pool.count += 1
+            self.record_change()
+            self.env.schedule(0, NORMAL, self.fire_granted if task.kind == 'fire' else self.request_processed, task)
+
+    def release(self, task, then=None):
+        # Frees the modeler straight away; the queue only gets a look in once the release event is processed.
+        # then: action to resume with after that, for processes that yield the release
+        if task.granted:
+            task.granted = False
+            self.modeler_beach.count -= 1
+            self.record_change()
+        self.env.schedule(0, NORMAL, self.trigger_put if then is None else then, task)
+
+    # fire_staff
+
+    def fire_granted(self, task):
+        self.counter_fired = self.counter_fired + 1
+        self.record_change()
+        weeks_remaining = max(1,round(self.rng.normal(self.params.hiring_mean, self.params.hiring_sdev),0))
+        self.env.schedule(int(weeks_remaining), NORMAL, self.fire_hired, task)
+
+    def fire_hired(self, task):
+        self.counter_hired = self.counter_hired + 1
+        self.record_change()
+        self.release(task)
+
+    # build_model and monitor_model
+
+    def task_start(self, task):
+        params = self.params
+        max_weeks = params.model_monitor_max_weeks if task.kind == 'monitor' else params.model_build_max_weeks
+        weeks_until_start = max(0, task.start_after - self.env.now)
+        task.deadline = max(0, task.start_by - self.env.now - max_weeks)
+        self.env.schedule(weeks_until_start, NORMAL, self.task_request, task)
+
+    def task_request(self, task):
+        # req | env.timeout(weeks_until_deadline).  If the modeler was free, the request event is already due this
+        # week, ahead of the timeout, so the timeout could never win and isn't scheduled at all
+        self.request(task)
+        if not task.granted:
+            self.env.schedule(task.deadline, NORMAL, self.deadline_passed, task)
+
+    def request_processed(self, task):
+        task.request_done = True
+        if not task.condition_done:
+            task.condition_done = True
+            self.env.schedule(0, NORMAL, self.condition_processed, task)
+
+    def deadline_passed(self, task):
+        if not task.condition_done:
+            task.condition_done = True
+            self.env.schedule(0, NORMAL, self.condition_processed, task)
+
+    def condition_processed(self, task):
+        # req in results: the request event got processed before the condition did
+        params = self.params
+        if task.request_done:
+            if task.kind == 'monitor':
+                weeks = sample_uniform(self.rng, params.model_monitor_min_weeks, params.model_monitor_max_weeks)
+            else:
+                weeks = sample_uniform(self.rng, params.model_build_min_weeks, params.model_build_max_weeks)
+            self.env.schedule(int(weeks), NORMAL, self.work_done, task)
+        else:
+            if task.kind == 'monitor':
+                self.counter_failed_monitors += 1
+            else:
+                self.counter_failed_rebuilds += 1
+            self.task_exit(task)
+
+    def work_done(self, task):
+        # yield modeler_beach.release(req)
+        self.release(task, then=self.work_released)
+
+    def work_released(self, task):
+        self.trigger_put()
+        if task.kind == 'monitor':
+            self.task_exit(task)
+            return
+        if task.kind == 'build':
+            self.counter_models_completed += 1
+            self.record_change()
+        task.rebuild_after = target_quarter(self.env.now, 7)
+        task.rebuild_by = target_quarter(self.env.now, 13)
+        self.next_child(task)
+
+    def next_child(self, task):
+        # Six monitors, one after the other, then the rebuild.  Then this task is done
+        now = self.env.now
+        if task.monitors < 6:
+            task.monitors += 1
+            monitor = Task('monitor', priority_monitor, target_quarter(now, 1), target_quarter(now, 2), task)
+            self.env.schedule(0, URGENT, self.task_start, monitor)
+        elif not task.rebuild_started:
+            task.rebuild_started = True
+            rebuild = Task('rebuild', priority_rebuild, task.rebuild_after, task.rebuild_by, task)
+            self.env.schedule(0, URGENT, self.task_start, rebuild)
+        else:
+            self.task_exit(task)
+
+    def task_exit(self, task):
+        # Leaving the with block cancels the request if it is still waiting and releases it (again, if the
+        # process already did).  Then the process finishes, and the parent waiting on it carries on
+        task.waiting = False
+        self.release(task)
+        if task.parent is not None:
+            self.env.schedule(0, NORMAL, self.next_child, task.parent)
+
+
+#%%
+
+# Multi-team engine
+
+# One team in a multi-team run.  Field names mirror the StaffingParams fields they stand in for
+TeamSpec = collections.namedtuple('TeamSpec', ['name', 'modeler_target_team_size', 'modeler_start_team_size',
+                                               'models_total'])
+
+class TeamTask(Task):
+    """Task in a MultiTeamSimulation: which team it is for, and which team's modeler it holds"""
+    __slots__ = ('team', 'lender')
+
+    def __init__(self, kind, priority, team, start_after=0, start_by=0, parent=None):
+        super().__init__(kind, priority, start_after, start_by, parent)
+        self.team = team
+        self.lender = None
+
+
+class StaffingTeam(StaffingSimulation):
+    """One team's modeler pool, counters and reporting series in a MultiTeamSimulation"""
+    # Only the bookkeeping half of StaffingSimulation (record_change, weekly_series, result) gets used, with
+    # params being the scenario's StaffingParams with this team's size and models filled in
+
+    def __init__(self, index, params, env, quit_weeks):
+        self.index = index
+        self.params = params
+        self.env = env
+        self.modeler_beach = ModelerPool(params.modeler_target_team_size)
+        self.quit_weeks = quit_weeks
+        self.counter_fired = 0
+        self.counter_hired = 0
+        self.counter_failed_rebuilds = 0
+        self.counter_failed_monitors = 0
+        self.counter_models_completed = 0
+        self.counter_borrowed = 0     # Tasks that got a modeler from another team
+        self.ds_changes = [(0, 0, 0, 0, 0, 0)]
+        self.reported_week = None
+
+
+class MultiTeamSimulation(FastStaffingSimulation):
+    """Several modeling teams in one simulation, each with its own modelers and models"""
+    # Runs on the fast engine's event calendar.  Each team has its own quits and its own queue, a heap, so a
+    # freed modeler goes to the best waiting request in one pop however many tasks there are.
+    # recruiters: how many vacancies the shared recruiting team can work on at once (None = no limit).  A
+    # vacancy waits for a free recruiter, first come first served, and the fire_staff hiring time only starts
+    # when one picks it up.
+    # borrowing: a task whose own team has no one free can take an idle modeler from another team.  Teams see
+    # to their own queue first; borrowable requests also sit in one queue across all teams for lenders to
+    # take from.  Vacancies are never borrowed.
+    # With one team, no recruiter limit and no borrowing it gives exactly the same results as
+    # FastStaffingSimulation
+
+    def __init__(self, teams, recruiters=None, borrowing=False):
+        self.team_specs = teams
+        self.recruiters = recruiters
+        self.borrowing = borrowing
+
+    def run(self, seed, params):
+        """Run one DURATION-week simulation.  Returns one StaffingResult per team, in order"""
+        # params sets everything the teams share; its team size and models_total are ignored
+        self.params = params
+        self.rng = RandomPool(seed)
+        self.env = Calendar()
+
+        p_quit = weekly_quit_probability(params.quitting_mean, params.quitting_sdev)
+        self.teams = []
+        for i, spec in enumerate(self.team_specs):
+            team_params = params._replace(modeler_target_team_size=spec.modeler_target_team_size,
+                                          modeler_start_team_size=spec.modeler_start_team_size,
+                                          models_total=spec.models_total)
+            team_quits = set(quit_weeks(self.rng.generator, p_quit, params.duration))
+            self.teams.append(StaffingTeam(i, team_params, self.env, team_quits))
+        self.sequence = itertools.count()
+        self.waiting = []           # Borrowable requests from every team, best first
+        self.spare = {team.index for team in self.teams if team.modeler_beach.capacity}  # Teams with someone free
+        self.recruiting = 0
+        self.vacancies = collections.deque()
+
+        self.env.schedule(0, URGENT, self.setup_staff, None)
+        self.env.schedule(0, URGENT, self.weekly_tick, self.staff_management)
+        self.env.schedule(0, URGENT, self.weekly_tick, self.weekly_reporting)
+        for team in self.teams:
+            for i in range(team.params.models_total):
+                task = TeamTask('build', priority_build, team.index, 5, params.duration)
+                self.env.schedule(0, URGENT, self.task_start, task)
+        self.env.run(params.duration)
+        return [team.result() for team in self.teams]
+
+    def setup_staff(self, task):
+        for team in self.teams:
+            for i in range(team.params.modeler_target_team_size - team.params.modeler_start_team_size):
+                self.env.schedule(0, URGENT, self.request, TeamTask('fire', priority_fire, team.index))
+
+    def staff_management(self, week):
+        for team in self.teams:
+            if week in team.quit_weeks:
+                self.env.schedule(0, URGENT, self.request, TeamTask('fire', priority_fire, team.index))
+
+    def weekly_reporting(self, week):
+        for team in self.teams:
+            team.reported_week = week
+
+    # modeler pools
+
+    def request(self, task):
+        entry = (task.priority, self.env.now, next(self.sequence), task)
+        task.waiting = True
+        heapq.heappush(self.teams[task.team].modeler_beach.waiting, entry)
+        if self.borrowing and task.kind != 'fire':
+            heapq.heappush(self.waiting, entry)
+        self.trigger_put(task)
+        if task.waiting and self.borrowing and task.kind != 'fire' and self.spare:
+            # Nobody free in its own team: a team that has someone free gives the best waiting request a look
+            self.give_modeler(self.teams[min(self.spare)])
+
+    def trigger_put(self, task=None):
+        # Whichever team the modeler was freed up in (or the request was made in) gets a look at its queue
+        self.give_modeler(self.teams[task.team if task.lender is None else task.lender])
+
+    def give_modeler(self, team):
+        # Like simpy, at most one request gets a modeler per look: the head of the team's own queue, or failing
+        # that (when borrowing) the best borrowable request from any team
+        pool = team.modeler_beach
+        waiting = pool.waiting
+        while waiting and not waiting[0][3].waiting:
+            heapq.heappop(waiting)   # Granted elsewhere, or cancelled while waiting
+        if pool.count >= pool.capacity:
+            return
+        if waiting:
+            task = heapq.heappop(waiting)[3]
+        elif self.borrowing:
+            while self.waiting and not self.waiting[0][3].waiting:
+                heapq.heappop(self.waiting)
+            if not self.waiting:
+                return
+            task = heapq.heappop(self.waiting)[3]
+            self.teams[task.team].counter_borrowed += 1
+        else:
+            return
+        task.waiting = False
+        task.granted = True
+        task.lender = team.index
+        pool.count += 1
+        if pool.count == pool.capacity:
+            self.spare.discard(team.index)
+        team.record_change()
+        self.env.schedule(0, NORMAL, self.fire_granted if task.kind == 'fire' else self.request_processed, task)
+
+    def release(self, task, then=None):
+        if task.granted:
+            task.granted = False
+            lender = self.teams[task.lender]
+            lender.modeler_beach.count -= 1
+            self.spare.add(lender.index)
+            lender.record_change()
+        self.env.schedule(0, NORMAL, self.trigger_put if then is None else then, task)
+
+    # fire_staff, with a shared recruiting team
+
+    def fire_granted(self, task):
+        team = self.teams[task.team]
+        team.counter_fired = team.counter_fired + 1
+        team.record_change()
+        if self.recruiters is None or self.recruiting < self.recruiters:
+            self.start_recruiting(task)
+        else:
+            self.vacancies.append(task)
+
+    def start_recruiting(self, task):
+        self.recruiting += 1
+        weeks_remaining = max(1,round(self.rng.normal(self.params.hiring_mean, self.params.hiring_sdev),0))
+        self.env.schedule(int(weeks_remaining), NORMAL, self.fire_hired, task)
+
+    def fire_hired(self, task):
+        team = self.teams[task.team]
+        team.counter_hired = team.counter_hired + 1
+        team.record_change()
+        self.release(task)
+        self.recruiting -= 1
+        if self.vacancies:
+            self.start_recruiting(self.vacancies.popleft())
+
+    # build_model and monitor_model
+
+    def condition_processed(self, task):
+        params = self.params
+        team = self.teams[task.team]
+        if task.request_done:
+            if task.kind == 'monitor':
+                weeks = sample_uniform(self.rng, params.model_monitor_min_weeks, params.model_monitor_max_weeks)
+            else:
+                weeks = sample_uniform(self.rng, params.model_build_min_weeks, params.model_build_max_weeks)
+            self.env.schedule(int(weeks), NORMAL, self.work_done, task)
+        else:
+            if task.kind == 'monitor':
+                team.counter_failed_monitors += 1
+            else:
+                team.counter_failed_rebuilds += 1
+            self.task_exit(task)
+
+    def work_released(self, task):
+        self.trigger_put(task)
+        if task.kind == 'monitor':
+            self.task_exit(task)
+            return
+        if task.kind == 'build':
+            team = self.teams[task.team]
+            team.counter_models_completed += 1
+            team.record_change()
+        task.rebuild_after = target_quarter(self.env.now, 7)
+        task.rebuild_by = target_quarter(self.env.now, 13)
+        self.next_child(task)
+
+    def next_child(self, task):
+        now = self.env.now
+        if task.monitors < 6:
+            task.monitors += 1
+            monitor = TeamTask('monitor', priority_monitor, task.team, target_quarter(now, 1), target_quarter(now, 2), task)
+            self.env.schedule(0, URGENT, self.task_start, monitor)
+        elif not task.rebuild_started:
+            task.rebuild_started = True
+            rebuild = TeamTask('rebuild', priority_rebuild, task.team, task.rebuild_after, task.rebuild_by, task)
+            self.env.schedule(0, URGENT, self.task_start, rebuild)
+        else:
+            self.task_exit(task)
+
+def run_teams(params, teams, iterations, seed=None, recruiters=None, borrowing=False):
+    """Run iterations of a multi-team scenario.  Returns a DataFrame with one row per iteration and team"""
+    # Same per-iteration seeds as run_iterations.  borrowed: tasks that got a modeler from another team
+    rows = []
+    for i, iteration_seed in enumerate(np.random.SeedSequence(seed).spawn(iterations)):
+        sim = MultiTeamSimulation(teams, recruiters, borrowing)
+        results = sim.run(iteration_seed, params)
+        for spec, team, result in zip(teams, sim.teams, results):
+            row = {'iteration': i, 'team': spec.name}
+            row.update(result._asdict())
+            row['borrowed'] = team.counter_borrowed
+            rows.append(row)
+    return pd.DataFrame(rows)
+
+
+#%%
+
+# Lockstep engine
+
+# Each model works through one task at a time: its build, then six monitors, then a rebuild (which starts the
+# six monitors over).  Stage numbers for those tasks, and the states a task goes through
+STAGE_BUILD = 0
+STAGE_LAST_MONITOR = 6
+STAGE_REBUILD = 7
+PENDING, QUEUED, WORKING, DONE = range(4)
+# What a task's timeout that week was waiting for
+FINISHED, STARTING, LATE = range(3)
+
+class LockstepStaffing(object):
+    """Every iteration of one scenario stepped forward together, one week at a time, on NumPy arrays"""
+    # Row = iteration, column = model.  As each model only ever has one task on the go, the modeler_beach queue
+    # is just the cells in the QUEUED state.  Fire requests beat everything (priority 0), so they are only a count
+    # per iteration, and hires coming back are a (iteration, week) table filled in as modelers are fired.
+    # Within a week, simpy works through the timeouts due that week in the order they were scheduled: work
+    # finishing frees a modeler, a task starting asks for one (and gets it if one is free right then), a
+    # deadline passing fails a request.  Then quits come in, the week is reported, and last of all the modelers
+    # freed up that week go to whoever is best placed in the queue.  Each task carries sequence numbers from
+    # when it was set up, asked for a modeler and got one, so those timeouts can be taken in the same order.
+    # Every iteration gets its k-th event of the week handled at the same time.
+    # The random draws are different from the other engines, so results match them in distribution rather
+    # than iteration by iteration
+
+    def __init__(self, params, iterations, seed=None):
+        self.params = params
+        self.rng = np.random.default_rng(seed)
+        n, m = iterations, params.models_total
+        self.iterations = n
+
+        # Per stage: queue priority, the longest the task can take, and the (min, max) weeks it does take
+        build_range = (params.model_build_min_weeks, params.model_build_max_weeks)
+        monitor_range = (params.model_monitor_min_weeks, params.model_monitor_max_weeks)
+        ranges = np.array([build_range] + [monitor_range] * STAGE_LAST_MONITOR + [build_range])
+        self.stage_priority = np.array([priority_build] + [priority_monitor] * STAGE_LAST_MONITOR + [priority_rebuild])
+        self.stage_min = ranges[:, 0]
+        self.stage_max = ranges[:, 1]
+
+        # Staffing: busy modelers, fire requests waiting for a modeler, and hires due back each week.  The
+        # starting vacancies are fire requests that get their modelers after the week 0 report
+        p_quit = weekly_quit_probability(params.quitting_mean, params.quitting_sdev)
+        self.quits = self.rng.random((n, params.duration)) < p_quit
+        self.count = np.zeros(n, dtype=np.int64)
+        self.fire_waiting = np.full(n, params.modeler_target_team_size - params.modeler_start_team_size)
+        self.hires_due = np.zeros((n, params.duration + 1), dtype=np.int64)
+
+        # Tasks.  start is the week a pending task asks for a modeler.  Builds are set up at week 0, ask at
+        # week 5 and are given until week 5 + DURATION - build max weeks
+        self.state = np.full((n, m), PENDING)
+        self.stage = np.full((n, m), STAGE_BUILD)
+        self.start = np.full((n, m), 5)
+        self.deadline = np.full((n, m), 5 + max(0, params.duration - params.model_build_max_weeks))
+        self.end = np.zeros((n, m), dtype=np.int64)
+        self.rebuild_after = np.zeros((n, m), dtype=np.int64)
+        self.rebuild_by = np.zeros((n, m), dtype=np.int64)
+        self.sequence = m
+        self.created_seq = np.tile(np.arange(m), (n, 1))
+        self.request_seq = np.zeros((n, m), dtype=np.int64)
+        self.granted_seq = np.zeros((n, m), dtype=np.int64)
+
+        # Counters, and the weekly series they are reported into
+        self.hired = np.zeros(n, dtype=np.int64)
+        self.fired = np.zeros(n, dtype=np.int64)
+        self.failed_rebuilds = np.zeros(n, dtype=np.int64)
+        self.failed_monitors = np.zeros(n, dtype=np.int64)
+        self.models_completed = np.zeros(n, dtype=np.int64)
+        self.available_modelers = np.zeros((n, params.duration), dtype=np.int64)
+        self.models_completed_series = np.zeros((n, params.duration), dtype=np.int64)
+
+    def next_sequence(self, k):
+        # Sequence numbers are only compared within an iteration, so one counter does for all of them
+        seq = np.arange(self.sequence, self.sequence + k)
+        self.sequence += k
+        return seq
+
+    def run(self):
+        capacity = self.params.modeler_target_team_size
+        for week in range(self.params.duration):
+            week_seq = self.sequence
+            self.count -= self.hires_due[:, week]
+            self.hired += self.hires_due[:, week]
+            # A finished build only counts towards models_completed in the following week's report
+            models_completed = self.models_completed.copy()
+
+            # Timeouts due this week that were scheduled in earlier weeks, in the order they were scheduled
+            finished = (self.state == WORKING) & (self.end <= week)
+            starting = (self.state == PENDING) & (self.start <= week) & (self.created_seq < week_seq)
+            late = (self.state == QUEUED) & (self.deadline <= week) & (self.request_seq < week_seq)
+            rows, cols = np.nonzero(finished | starting | late)
+            kinds = np.where(finished[rows, cols], FINISHED, np.where(starting[rows, cols], STARTING, LATE))
+            seq = np.choose(kinds, [self.granted_seq[rows, cols], self.created_seq[rows, cols],
+                                    self.request_seq[rows, cols]])
+            self.handle_events(week, rows, cols, kinds, seq)
+
+            # Quits take a free modeler straight away if there is one, otherwise join the front of the queue
+            self.fire_waiting += self.quits[:, week]
+            self.grant(week, (self.quits[:, week] & (self.count < capacity)).astype(np.int64))
+
+            self.available_modelers[:, week] = capacity - self.count
+            self.models_completed_series[:, week] = models_completed
+            self.grant(week, capacity - self.count)
+
+            # A rebuild set up this week (its last monitor just finished or failed) can also be due this week.
+            # It only asks once the modelers freed up this week have gone to the queue, the monitor's own included
+            rows, cols = np.nonzero((self.state == PENDING) & (self.start <= week))
+            if len(rows):
+                self.handle_events(week, rows, cols, np.full(len(rows), STARTING), self.created_seq[rows, cols])
+        return self
+
+    def handle_events(self, week, rows, cols, kinds, seq):
+        # Sort each iteration's events into order, then take the first event of every iteration together,
+        # then the second, and so on
+        if not len(rows):
+            return
+        order = np.lexsort((seq, rows))
+        rows, cols, kinds = rows[order], cols[order], kinds[order]
+        firsts = np.r_[0, np.flatnonzero(np.diff(rows)) + 1]
+        ranks = np.arange(len(rows)) - np.repeat(firsts, np.diff(np.r_[firsts, len(rows)]))
+        order = np.argsort(ranks, kind='stable')
+        splits = np.flatnonzero(np.diff(ranks[order])) + 1
+        for at in np.split(order, splits):
+            r, c, kind = rows[at], cols[at], kinds[at]
+            self.finish(r[kind == FINISHED], c[kind == FINISHED], week)
+            self.request(r[kind == STARTING], c[kind == STARTING], week)
+            self.fail(r[kind == LATE], c[kind == LATE], week)
+
+    def finish(self, rows, cols, week):
+        # rows never repeats: at most one event per iteration is handled at a time
+        if not len(rows):
+            return
+        stage = self.stage[rows, cols]
+        self.count[rows] -= 1
+        self.models_completed[rows[stage == STAGE_BUILD]] += 1
+        # Finishing a build or rebuild sets the window for the next rebuild, 6 to 12 quarters out
+        built = (stage == STAGE_BUILD) | (stage == STAGE_REBUILD)
+        self.rebuild_after[rows[built], cols[built]] = target_quarter(week, 7)
+        self.rebuild_by[rows[built], cols[built]] = target_quarter(week, 13)
+        self.next_task(rows, cols, week)
+
+    def request(self, rows, cols, week):
+        # Asking for a modeler gives the one free modeler (if any) to the front of the queue, usually the asker
+        if not len(rows):
+            return
+        self.state[rows, cols] = QUEUED
+        self.request_seq[rows, cols] = self.next_sequence(len(rows))
+        free = np.zeros(self.iterations, dtype=np.int64)
+        free[rows] = self.count[rows] < self.params.modeler_target_team_size
+        self.grant(week, free)
+        # With no time allowed, a request that didn't get a modeler straight away has already failed
+        late = self.deadline[rows, cols] <= week
+        self.fail(rows[late], cols[late], week)
+
+    def fail(self, rows, cols, week):
+        if not len(rows):
+            return
+        queued = self.state[rows, cols] == QUEUED
+        rows, cols = rows[queued], cols[queued]
+        stage = self.stage[rows, cols]
+        built = (stage == STAGE_BUILD) | (stage == STAGE_REBUILD)
+        self.failed_rebuilds[rows[built]] += 1
+        self.failed_monitors[rows[~built]] += 1
+        # A failed build or rebuild is the end of that model.  A failed monitor just moves on to the next one
+        self.state[rows[built], cols[built]] = DONE
+        self.next_task(rows[~built], cols[~built], week)
+
+    def next_task(self, rows, cols, week):
+        # Monitors start next quarter and must start in time to finish by the quarter after.  After the sixth
+        # monitor comes the rebuild, in the window set when the model was last built
+        if not len(rows):
+            return
+        stage = np.where(self.stage[rows, cols] == STAGE_LAST_MONITOR, STAGE_REBUILD,
+                         np.where(self.stage[rows, cols] == STAGE_REBUILD, 1, self.stage[rows, cols] + 1))
+        rebuild = stage == STAGE_REBUILD
+        start_after = np.where(rebuild, self.rebuild_after[rows, cols], target_quarter(week, 1))
+        start_by = np.where(rebuild, self.rebuild_by[rows, cols], target_quarter(week, 2))
+        # As in build_model / monitor_model, the time allowed is worked out now but only counts from the request
+        start = np.maximum(start_after, week)
+        self.stage[rows, cols] = stage
+        self.start[rows, cols] = start
+        self.deadline[rows, cols] = start + np.maximum(0, start_by - week - self.stage_max[stage])
+        self.state[rows, cols] = PENDING
+        self.created_seq[rows, cols] = self.next_sequence(len(rows))
+
+    def grant(self, week, free):
+        """Hand out up to free[i] modelers in iteration i: fire requests first, then the best queued tasks"""
+        fires = np.minimum(np.maximum(free, 0), self.fire_waiting)
+        if fires.any():
+            rows = np.repeat(np.arange(self.iterations), fires)
+            # Note: we use the hiring mean/sdev because that's the time necessary to hire a fired employee
+            weeks_remaining = np.maximum(1, np.rint(self.rng.normal(self.params.hiring_mean, self.params.hiring_sdev,
+                                                                    len(rows)))).astype(np.int64)
+            np.add.at(self.hires_due, (rows, np.minimum(week + weeks_remaining, self.params.duration)), 1)
+            self.fire_waiting -= fires
+            self.count += fires
+            self.fired += fires
+            free = free - fires
+
+        candidates = np.flatnonzero(free > 0)
+        queued = self.state[candidates] == QUEUED
+        waiting = queued.any(axis=1)
+        candidates, queued = candidates[waiting], queued[waiting]
+        if not len(candidates):
+            return
+        # Rank each iteration's queue by priority, then by who asked first; anything not queued sorts last
+        m = self.params.models_total
+        key = self.stage_priority[self.stage[candidates]] * self.sequence + self.request_seq[candidates]
+        key[~queued] = np.iinfo(np.int64).max
+        order = np.argsort(key, axis=1)
+        taken = (np.arange(m) < free[candidates, None]) & np.take_along_axis(queued, order, axis=1)
+        ranks, places = np.nonzero(taken.T)
+        rows, cols = candidates[places], order[places, ranks]
+
+        stage = self.stage[rows, cols]
+        low, high = self.stage_min[stage] - 0.5, self.stage_max[stage] + 0.5
+        self.end[rows, cols] = week + np.rint(low + (high - low) * self.rng.random(len(rows))).astype(np.int64)
+        self.state[rows, cols] = WORKING
+        self.granted_seq[rows, cols] = self.next_sequence(len(rows))
+        self.count += np.bincount(rows, minlength=self.iterations)
+
+    def results(self):
+        """One StaffingResult per iteration, worked out the same way as StaffingSimulation.result"""
+        params = self.params
+        all_built = self.models_completed_series == params.models_total
+        end_period = np.where(all_built.any(axis=1), all_built.argmax(axis=1), params.duration)
+
+        # Average of [0] plus the available FTE from end_period to the end of the run
+        from_end = np.cumsum(self.available_modelers[:, ::-1], axis=1)[:, ::-1]
+        from_end = np.concatenate([from_end, np.zeros((self.iterations, 1), dtype=np.int64)], axis=1)
+        capacity = np.round(from_end[np.arange(self.iterations), end_period] / (params.duration - end_period + 1), 3)
+
+        monitor_attempts = params.models_total * ((params.duration / 52) - 1) * 4
+        failed_monitor_pct = np.round(self.failed_monitors / monitor_attempts, 2)
+        return [StaffingResult(*row) for row in zip(self.hired.tolist(), self.fired.tolist(),
+                                                    self.failed_rebuilds.tolist(), self.failed_monitors.tolist(),
+                                                    failed_monitor_pct.tolist(), end_period.tolist(),
+                                                    capacity.tolist())]
+
+def simulate_lockstep(params, iterations, seed=None):
+    """Run every iteration of one scenario with the lockstep engine.  Returns StaffingResults in order"""
+    return LockstepStaffing(params, iterations, seed).run().results()
+
+def compare_engines(results, other_results, fields=('end_period', 'capacity', 'failed_monitor_pct')):
+    """Mean and percentiles of each field for two sets of results, side by side"""
+    rows = {}
+    for name, engine_results in (('this engine', results), ('other engine', other_results)):
+        for field in fields:
+            values = np.array([getattr(result, field) for result in engine_results], dtype=float)
+            rows[(field, name)] = {'mean': values.mean(), 'P5': np.percentile(values, 5),
+                                   'P50': np.percentile(values, 50), 'P95': np.percentile(values, 95)}
+    return pd.DataFrame(rows).T.sort_index()
+
+#%%
+
+# Tracing
+
+# Process kind for each generator function.  build_model is split into build and rebuild by its argument
+PROCESS_KINDS = {'setup_staff': 'setup', 'fire_staff': 'fire', 'monitor_model': 'monitor', 'start': 'weekly'}
+
+class SimulationTrace(object):
+    """Opt-in instrumentation for one StaffingSimulation run: StaffingSimulation(trace=SimulationTrace())"""
+
+    def __init__(self):
+        self.process_counts = collections.Counter()   # Processes started, by kind
+        self.event_counts = collections.Counter()     # Events yielded, by kind
+        self.wall_time = collections.Counter()        # Seconds spent inside the generators, by kind
+        self.steps = 0                                # Events the environment processed, all kinds
+        self.spans = []                               # [kind, track, start week, end week (None if unfinished)]
+        self.queue_lengths = [(0, 0, 0)]              # (week, requests waiting, modelers busy) at every change
+        self.resource = None
+        self.end_week = None
+
+    def wrap(self, env, generator):
+        # Kind and track (the model's name, or Staff) come from the generator's arguments
+        args = generator.gi_frame.f_locals
+        kind = args.get('build_or_rebuild', PROCESS_KINDS.get(generator.gi_code.co_name, generator.gi_code.co_name))
+        return self.traced(env, generator, kind, args.get('name', 'Staff'))
+
+    def traced(self, env, generator, kind, track):
+        # Drives the real generator one step at a time, timing each step and passing events and values through
+        self.process_counts[kind] += 1
+        span = [kind, track, env.now, None]
+        self.spans.append(span)
+        send, value = generator.send, None
+        while True:
+            began = time.perf_counter()
+            try:
+                event = send(value)
+            except StopIteration as stop:
+                self.wall_time[kind] += time.perf_counter() - began
+                span[3] = env.now
+                return stop.value
+            self.wall_time[kind] += time.perf_counter() - began
+            self.event_counts[kind] += 1
+            try:
+                value = yield event
+                send = generator.send
+            except Exception as error:
+                # A failed event or an interrupt: hand it to the real generator, as simpy would have
+                send, value = generator.throw, error
+
+    def sample(self, week):
+        waiting, busy = len(self.resource.put_queue), self.resource.count
+        if (waiting, busy) != self.queue_lengths[-1][1:]:
+            self.queue_lengths.append((week, waiting, busy))
+
+    def summary(self):
+        """One row per process kind: processes, events, and wall time in total and per event"""
+        kinds = sorted(self.process_counts)
+        df = pd.DataFrame({
+            'processes': [self.process_counts[kind] for kind in kinds],
+            'events': [self.event_counts[kind] for kind in kinds],
+            'wall_ms': [1000 * self.wall_time[kind] for kind in kinds],
+        }, index=pd.Index(kinds, name='kind'))
+        df['us_per_event'] = 1000 * df['wall_ms'] / df['events'].clip(lower=1)
+        return df
+
+    def chrome_trace(self, us_per_week=1000):
+        """Trace in the Chrome trace event format (chrome://tracing or ui.perfetto.dev).  One track per model"""
+        # Timestamps are simulation weeks scaled by us_per_week, not wall time.  Processes still running at
+        # the end of the simulation are cut off there
+        end_week = self.end_week if self.end_week is not None else max(span[2] for span in self.spans)
+        tracks = {}
+        events = []
+        for kind, track, start, end in self.spans:
+            tid = tracks.setdefault(track, len(tracks))
+            end = end_week if end is None else end
+            events.append({'name': kind, 'cat': kind, 'ph': 'X', 'pid': 0, 'tid': tid,
+                           'ts': start * us_per_week, 'dur': (end - start) * us_per_week})
+        for week, waiting, busy in self.queue_lengths:
+            events.append({'name': 'modeler_beach', 'ph': 'C', 'pid': 0, 'ts': week * us_per_week,
+                           'args': {'waiting': waiting, 'busy': busy}})
+        for track, tid in tracks.items():
+            events.append({'name': 'thread_name', 'ph': 'M', 'pid': 0, 'tid': tid, 'args': {'name': track}})
+        return {'traceEvents': events, 'otherData': {'us_per_week': us_per_week, 'steps': self.steps}}
+
+    def write_chrome_trace(self, path, us_per_week=1000):
+        with open(path, 'w') as trace_file:
+            json.dump(self.chrome_trace(us_per_week), trace_file, separators=(',', ':'))
+
+
+class TracingEnvironment(simpy.Environment):
+    """simpy Environment that feeds a SimulationTrace.  Only used when a trace is asked for"""
+
+    def __init__(self, trace):
+        super().__init__()
+        self.trace = trace
+
+    def process(self, generator):
+        return super().process(self.trace.wrap(self, generator))
+
+    def step(self):
+        super().step()
+        self.trace.steps += 1
+        if self.trace.resource is not None:
+            self.trace.sample(self.now)
+
+
+#%%
+
+# Checkpoints
+
+class ResultStore(object):
+    """Per-iteration StaffingResults kept in a SQLite file, one row per (scenario, seed, iteration)"""
+    # Rows are only ever added, one committed batch per finished job, so a crash or preemption loses at most
+    # the jobs that were still running.  An iteration is identified by its full StaffingParams, the root seed
+    # and its index: that is all run_iterations / run_sweep need to hand it the same SeedSequence child again,
+    # so a resumed (or extended) run skips whatever is already stored and ends up with exactly the results an
+    # uninterrupted run would have had.  The simpy and fast engines give the same results, so they share rows
+    key_columns = StaffingParams._fields + ('seed', 'iteration')
+
+    def __init__(self, path):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        columns = ('scenario_name',) + self.key_columns + StaffingResult._fields
+        self.connection.execute('CREATE TABLE IF NOT EXISTS results (%s, PRIMARY KEY (%s))'
+                                % (', '.join(columns), ', '.join(self.key_columns)))
+        self.connection.commit()
+
+    def seed_key(self, seed):
+        if seed is None:
+            raise ValueError('Checkpointed runs need a fixed seed so they can be resumed')
+        return str(seed)
+
+    def load(self, params, seed, iterations=None):
+        """Stored results for one scenario and seed, as {iteration: StaffingResult}, optionally only below iterations"""
+        where = ' AND '.join('%s = ?' % field for field in StaffingParams._fields + ('seed',))
+        query = 'SELECT iteration, %s FROM results WHERE %s' % (', '.join(StaffingResult._fields), where)
+        rows = self.connection.execute(query, tuple(params) + (self.seed_key(seed),))
+        return {row[0]: StaffingResult(*row[1:]) for row in rows if iterations is None or row[0] < iterations}
+
+    def save(self, params, seed, iterations, results):
+        """Add one batch of results (iterations and results in the same order) and commit it"""
+        rows = [(scenario_name(params),) + tuple(params) + (self.seed_key(seed), i) + tuple(result)
+                for i, result in zip(iterations, results)]
+        placeholders = ', '.join(['?'] * (1 + len(self.key_columns) + len(StaffingResult._fields)))
+        self.connection.executemany('INSERT OR IGNORE INTO results VALUES (%s)' % placeholders, rows)
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+#%%
+
+# Scenario farm
+
+# 'simpy' is the reference model; 'fast' gives the same results for the same seeds on the event calendar above
+ENGINES = {'simpy': StaffingSimulation, 'fast': FastStaffingSimulation}
+
+def _run_shard(seeds, params, engine='simpy'):
+    # Worker side of run_jobs
+    return [ENGINES[engine]().run(seed, params) for seed in seeds]
+
+def report_progress(done, total, started):
+    elapsed = time.perf_counter() - started
+    rate = done / elapsed if elapsed > 0 else 0
+    eta = (total - done) / rate if rate > 0 else 0
+    print('Finished %d of %d iterations (%.1f iterations/sec, about %ds left)' % (done, total, rate, eta))
+
+def worker_context():
+    """multiprocessing context for every worker process in these scripts.  None = no fork here, run in-process"""
+    # Fork keeps the workers from re-running the calling script on start-up.  The scripts have no __main__ guard,
+    # so under spawn (the only option on Windows) every worker would re-run the whole script
+    return multiprocessing.get_context('fork') if 'fork' in multiprocessing.get_all_start_methods() else None
+
+def run_jobs(jobs, workers=1, progress_every=50, engine='simpy', on_done=None):
+    """Run a queue of (params, seeds) jobs, in the order given.  Returns each job's StaffingResults"""
+    # This is the one job queue behind run_iterations and run_sweep.  Jobs are handed out in list order,
+    # so callers put the jobs they expect to take longest first.
+    # on_done(j, results) is called as each job finishes (in whatever order they finish), e.g. to checkpoint them
+    total = sum(len(seeds) for params, seeds in jobs)
+    results = [None] * len(jobs)
+    started = time.perf_counter()
+    if workers is None:
+        workers = os.cpu_count()
+    mp_context = worker_context()
+    if workers > 1 and mp_context is None:
+        print('No fork start method on this platform; running the iterations in-process')
+        workers = 1
+    if workers <= 1:
+        done = 0
+        for j, (params, seeds) in enumerate(jobs):
+            results[j] = []
+            for seed in seeds:
+                results[j].append(ENGINES[engine]().run(seed, params))
+                done += 1
+                if done % progress_every == 0 or done == total:
+                    report_progress(done, total, started)
+            if on_done is not None:
+                on_done(j, results[j])
+        return results
+
+    with ProcessPoolExecutor(max_workers=workers, mp_context=mp_context) as pool:
+        futures = {pool.submit(_run_shard, seeds, params, engine): j for j, (params, seeds) in enumerate(jobs)}
+        done = 0
+        for future in as_completed(futures):
+            j = futures[future]
+            results[j] = future.result()
+            done += len(results[j])
+            report_progress(done, total, started)
+            if on_done is not None:
+                on_done(j, results[j])
+    return results
+
+def shard_seeds(seeds, shard_size):
+    return [seeds[i:i + shard_size] for i in range(0, len(seeds), shard_size)]
+
+def run_iterations(params, iterations, seed=None, workers=1, progress_every=50, engine='simpy', store=None):
+    """Run every iteration of one scenario, optionally across a process pool.  Returns StaffingResults in order"""
+    # engine='lockstep' runs them all at once as one array program instead (in-process, workers is ignored)
+    # Iteration i always gets the i-th child of one SeedSequence, so results only depend on the seed,
+    # not on how many workers there are or how the iterations were sharded between them.
+    # Shards of progress_every iterations are small enough to balance the load, big enough that
+    # shipping the results back is nothing next to running them.
+    # store: optional ResultStore.  Iterations already in it are skipped, and each shard is saved as it finishes
+    if engine == 'lockstep':
+        if store is not None:
+            raise ValueError('The lockstep engine has no per-iteration seeds to checkpoint; use simpy or fast')
+        return simulate_lockstep(params, iterations, seed)
+    seeds = np.random.SeedSequence(seed).spawn(iterations)
+    if store is None:
+        jobs = [(params, shard) for shard in shard_seeds(seeds, progress_every)]
+        return [result for shard in run_jobs(jobs, workers, progress_every, engine) for result in shard]
+
+    results = store.load(params, seed, iterations)
+    shards = shard_seeds([i for i in range(iterations) if i not in results], progress_every)
+
+    def shard_done(j, shard_results):
+        results.update(zip(shards[j], shard_results))
+        store.save(params, seed, shards[j], shard_results)
+
+    run_jobs([(params, [seeds[i] for i in shard]) for shard in shards], workers, progress_every, engine, shard_done)
+    return [results[i] for i in range(iterations)]
+
+def run_batch(params, seeds, workers=1, engine='simpy', store=None, seed=None, first=0):
+    """One iteration per seed, split evenly over the workers.  Returns StaffingResults in seed order"""
+    # The lockstep engine runs the whole batch as one array program, seeded by the first seed.
+    # store: optional ResultStore, as in run_iterations.  seeds are then iterations first, first + 1, ... of the
+    # SeedSequence(seed) children: the ones already stored are skipped, and each shard is saved as it finishes
+    if engine == 'lockstep':
+        if store is not None:
+            raise ValueError('The lockstep engine has no per-iteration seeds to checkpoint; use simpy or fast')
+        return simulate_lockstep(params, len(seeds), seeds[0])
+    iterations = range(first, first + len(seeds))
+    results = {} if store is None else store.load(params, seed, iterations.stop)
+    todo = [i for i in iterations if i not in results]
+    shards = shard_seeds(todo, -(-len(todo) // (workers or os.cpu_count()))) if todo else []
+
+    def shard_done(j, shard_results):
+        results.update(zip(shards[j], shard_results))
+        if store is not None:
+            store.save(params, seed, shards[j], shard_results)
+
+    run_jobs([(params, [seeds[i - first] for i in shard]) for shard in shards], workers, len(seeds), engine,
+             shard_done)
+    return [results[i] for i in iterations]
+
+def results_array(results):
+    """StaffingResults as a NumPy record array, one row per iteration: records['capacity'] etc"""
+    return np.rec.array(np.array([tuple(result) for result in results], dtype=RESULT_DTYPE))
+
+def half_widths(results, fields, confidence=0.95):
+    """Confidence interval half-width of the mean of each field (normal approximation)"""
+    z = NormalDist().inv_cdf(0.5 + confidence / 2)
+    widths = {}
+    for field in fields:
+        values = np.array([getattr(result, field) for result in results], dtype=float)
+        widths[field] = float(z * values.std(ddof=1) / np.sqrt(len(values))) if len(values) > 1 else np.inf
+    return widths
+
+def run_until_precise(params, targets, batch_size=100, max_iterations=10000, seed=None, workers=1, engine='simpy',
+                      confidence=0.95, store=None):
+    """Run iterations in batches until every field's CI half-width is within its target, or max_iterations is hit"""
+    # targets: {StaffingResult field: half-width}, e.g. {'end_period': 1.0, 'failed_monitor_pct': 0.002}.
+    # Batches take the next children of one SeedSequence, so the first n results are exactly what
+    # run_iterations(params, n, seed) gives and a precise run is a prefix of a longer one.
+    # The lockstep engine is seeded by the first child of each batch instead.
+    # store: optional ResultStore.  Rows are keyed the same way as run_iterations', so a resumed precise run
+    # skips the iterations already saved, and shares them with fixed-size runs of the same scenario and seed
+    seed_sequence = np.random.SeedSequence(seed)
+    results = []
+    widths = {field: np.inf for field in targets}
+    while len(results) < max_iterations:
+        batch = min(batch_size, max_iterations - len(results))
+        results += run_batch(params, seed_sequence.spawn(batch), workers, engine, store, seed, len(results))
+        widths = half_widths(results, targets, confidence)
+        print('After %d iterations: ' % len(results) +
+              ', '.join('%s +/- %.4g (target %g)' % (field, widths[field], targets[field]) for field in targets))
+        if all(widths[field] <= targets[field] for field in targets):
+            return SequentialRun(results, widths, True)
+    return SequentialRun(results, widths, False)
+
+#%%
+
+# Scenario sweep
+
+def scenario_name(params):
+    # Same naming as the graphs: T<team>M<models>_<build min months><build max months><monitor min><monitor max>
+    return 'T%dM%d_%d%d%d%d' % (params.modeler_target_team_size, params.models_total,
+                                params.model_build_min_weeks // 4, params.model_build_max_weeks // 4,
+                                params.model_monitor_min_weeks, params.model_monitor_max_weeks)
+
+def estimated_cost(params):
+    # Rough relative run time of one iteration.  Every model is a chain of build/monitor/rebuild processes
+    # for the whole run, and a bigger team gets more of each chain done, so more events get scheduled
+    return params.duration * params.models_total * min(params.modeler_target_team_size, params.models_total)
+
+def sweep_cells(params, team_sizes, model_counts, build_weeks, monitor_weeks):
+    """Every combination of the grid, as StaffingParams.  build_weeks and monitor_weeks are (min, max) pairs"""
+    cells = []
+    for team_size, models_total, (build_min, build_max), (monitor_min, monitor_max) in itertools.product(
+            team_sizes, model_counts, build_weeks, monitor_weeks):
+        cells.append(params._replace(modeler_target_team_size=team_size, models_total=models_total,
+                                     model_build_min_weeks=build_min, model_build_max_weeks=build_max,
+                                     model_monitor_min_weeks=monitor_min, model_monitor_max_weeks=monitor_max))
+    return cells
+
+def run_sweep(params, iterations, team_sizes, model_counts, build_weeks, monitor_weeks, seed=None, workers=1,
+              progress_every=50, engine='simpy', store=None):
+    """Run every grid cell as one job queue.  Returns one row per scenario_name and iteration"""
+    # All cells x iterations go into a single queue so the workers stay busy across cell boundaries,
+    # with the most expensive cells queued first so no big cell is left running on its own at the end.
+    # Every cell uses the same per-iteration seeds as run_iterations (common random numbers), so a cell
+    # gives exactly the results of a stand-alone run with the same seed.
+    # With a ResultStore, (cell, iteration) pairs already in it are skipped and every shard is saved as it
+    # finishes, so an interrupted sweep picks up where it left off and a finished one can be extended
+    cells = sweep_cells(params, team_sizes, model_counts, build_weeks, monitor_weeks)
+    cell_results = [{} for cell in cells]  # iteration: StaffingResult
+    if engine == 'lockstep':
+        if store is not None:
+            raise ValueError('The lockstep engine has no per-iteration seeds to checkpoint; use simpy or fast')
+        # One array program per cell, every iteration at once, in-process
+        for c, cell in enumerate(cells):
+            cell_results[c] = dict(enumerate(simulate_lockstep(cell, iterations, seed)))
+    else:
+        seeds = np.random.SeedSequence(seed).spawn(iterations)
+        jobs, job_cells = [], []
+        for c in sorted(range(len(cells)), key=lambda c: estimated_cost(cells[c]), reverse=True):
+            if store is not None:
+                cell_results[c] = store.load(cells[c], seed, iterations)
+            for shard in shard_seeds([i for i in range(iterations) if i not in cell_results[c]], progress_every):
+                jobs.append((cells[c], [seeds[i] for i in shard]))
+                job_cells.append((c, shard))
+
+        def job_done(j, results):
+            c, shard = job_cells[j]
+            cell_results[c].update(zip(shard, results))
+            if store is not None:
+                store.save(cells[c], seed, shard, results)
+
+        run_jobs(jobs, workers, progress_every, engine, job_done)
+
+    rows = []
+    for c, cell in enumerate(cells):
+        for i, result in sorted(cell_results[c].items()):
+            row = {'scenario_name': scenario_name(cell), 'iteration': i}
+            row.update(cell._asdict())
+            row.update(result._asdict())
+            rows.append(row)
+    return pd.DataFrame(rows).sort_values(['scenario_name', 'iteration'], ignore_index=True)
+
+#%%
+
+# Team size search
+
+# What find_min_team_size reports: the smallest team size that met the target (None if not even the largest
+# one tried did), and one row per team size it looked at
+TeamSizeSearch = collections.namedtuple('TeamSizeSearch', ['team_size', 'evaluations'])
+
+def exceedance_interval(exceeded, n, confidence=0.95):
+    """Wilson score interval for the share of n iterations that went over the threshold"""
+    z = NormalDist().inv_cdf(0.5 + confidence / 2)
+    share = exceeded / n
+    centre = (share + z * z / (2 * n)) / (1 + z * z / n)
+    half_width = z * np.sqrt(share * (1 - share) / n + z * z / (4 * n * n)) / (1 + z * z / n)
+    return centre - half_width, centre + half_width
+
+def find_min_team_size(params, threshold, field='failed_monitor_pct', quantile=0.95, low=1, high=None,
+                       batch_size=100, max_iterations=2000, seed=None, workers=1, engine='simpy', confidence=0.95):
+    """Smallest modeler_target_team_size whose quantile of field is at most threshold, by bisection"""
+    # "P95 failed_monitor_pct <= 5%" is the same as "no more than 5% of iterations go over 5%", so each team
+    # size is a yes/no question about a share, answered with a confidence interval around it.  A team size
+    # gets one batch of iterations, and more only while the interval still straddles the allowed share: clear
+    # cut sizes cost one batch and the replications go to the close contenders around the answer.  A size
+    # still undecided at max_iterations goes by its point estimate.
+    # Every team size gets the same per-iteration seeds (common random numbers), and the search assumes a
+    # bigger team never does worse.  high defaults to twice the number of models
+    if high is None:
+        high = max(params.modeler_target_team_size, 2 * params.models_total)
+    allowed = 1 - quantile
+    seeds = np.random.SeedSequence(seed).spawn(max_iterations)
+    evaluations = {}
+
+    def meets_target(team_size):
+        team_params = params._replace(modeler_target_team_size=team_size)
+        results = []
+        decided = False
+        while len(results) < max_iterations and not decided:
+            results += run_batch(team_params, seeds[len(results):len(results) + batch_size], workers, engine)
+            values = np.array([getattr(result, field) for result in results], dtype=float)
+            exceeded = np.count_nonzero(values > threshold)
+            share_low, share_high = exceedance_interval(exceeded, len(values), confidence)
+            decided = share_high <= allowed or share_low > allowed
+        met = share_high <= allowed if decided else exceeded / len(values) <= allowed
+        evaluations[team_size] = {'iterations': len(values), 'quantile': np.quantile(values, quantile),
+                                  'share_over': exceeded / len(values), 'share_low': share_low,
+                                  'share_high': share_high, 'decided': decided, 'meets_target': met}
+        print('Team size %d: P%g %s = %.4g, %.1f%% of %d iterations over %g -> %s' % (
+              team_size, quantile * 100, field, evaluations[team_size]['quantile'], 100 * exceeded / len(values),
+              len(values), threshold, 'meets target' if met else 'misses target'))
+        return met
+
+    def report(team_size):
+        return TeamSizeSearch(team_size, pd.DataFrame.from_dict(evaluations, orient='index').sort_index())
+
+    if not meets_target(high):
+        return report(None)
+    failing, passing = low - 1, high
+    while passing - failing > 1:
+        middle = (failing + passing) // 2
+        if meets_target(middle):
+            passing = middle
+        else:
+            failing = middle
+    return report(passing)
@@ -1,9 +1,10 @@
-import simpy
-import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
-from statistics import mean
+from staffing_simulation import (ResultStore, StaffingParams, StaffingSimulation, SimulationTrace, compare_engines,
+                                 TeamSpec, find_min_team_size, run_iterations, run_sweep, run_teams,
+                                 results_array, run_until_precise)
+from staffing_reports import ReportWorker, summarize_results
 
+seed = 460  # Set the random seed for the scenario runs
 
 #%%
 
@@ -38,283 +39,133 @@ MODEL_BUILD_MAX_WEEKS = MODEL_BUILD_MAX_MONTHS * 4
 MODEL_MONITOR_MIN_WEEKS = 4
 MODEL_MONITOR_MAX_WEEKS = 6
 
-# Set up the priorities for different tasks to track
-priority_hire = 0
-priority_fire = 0
-priority_build = 3
-priority_monitor = 2
-priority_rebuild = 1
-
 scenario_name = 'T%dM%d_%d%d%d%d' % (MODELER_TARGET_TEAM_SIZE, MODELS_TOTAL, MODEL_BUILD_MIN_MONTHS,
                                         MODEL_BUILD_MAX_MONTHS, MODEL_MONITOR_MIN_WEEKS, MODEL_MONITOR_MAX_WEEKS)
 
-#%%
-
-# Control functions
+# Scenario sweep.  Runs every combination below in one go and writes a single results table (one row per
+# scenario_name and iteration) instead of editing the constants above and re-running for each graph
+SWEEP = False
+SWEEP_TEAM_SIZES = [6, 8, 10, 15]
+SWEEP_MODEL_COUNTS = [15, 25, 40]
+SWEEP_BUILD_MONTHS = [(6, 12)] # (min, max) pairs
+SWEEP_MONITOR_WEEKS = [(4, 6)] # (min, max) pairs
+SWEEP_FILENAME = 'sweep-results.csv'
+
+# Team size search.  Finds the smallest target team size where the OPTIMIZE_QUANTILE of OPTIMIZE_FIELD across
+# iterations is at most OPTIMIZE_THRESHOLD, for the MODELS_TOTAL and other assumptions above
+OPTIMIZE = False
+OPTIMIZE_FIELD = 'failed_monitor_pct'
+OPTIMIZE_QUANTILE = 0.95
+OPTIMIZE_THRESHOLD = 0.05 # i.e. 95% of the time no more than 5% of monitors fail
+
+# Multi-team mode.  Several teams, each with its own modelers and models (the other assumptions above are shared),
+# hiring through one recruiting team.  None = just the one team above
+TEAMS = None # e.g. [TeamSpec('Credit', 15, 4, 15), TeamSpec('Fraud', 8, 4, 25), TeamSpec('Pricing', 10, 6, 40)]
+RECRUITERS = None # Vacancies the recruiting team can work on at once.  None = no limit
+BORROWING = False # If True, a task can take an idle modeler from another team when its own has none free
+TEAMS_FILENAME = 'team-results.csv'
 
-def test_normal(mean, stdev):
-    # The function below generates a normal distribution, then takes the inverse, then runs a random check
-    # to see if a uniform number from 0-1 is below the value.
-    # This allows for us to identify, e.g., that there is an 8-week average time for an event to occur...
-    # So is THIS the week that will trigger?
+#%%
+# Each iteration is a self-contained StaffingSimulation (see staffing_simulation.py) with its own env, resource,
+# counters and random stream.  Per-iteration seeds come from one SeedSequence, so every run is reproducible and
+# the iterations can be spread across a process pool.  WORKERS = 1 runs them one after another in-process
+staffing_params = StaffingParams(DURATION, MODELER_TARGET_TEAM_SIZE, MODELER_START_TEAM_SIZE, HIRING_MEAN, HIRING_SDEV,
+                                 QUITTING_MEAN, QUITTING_SDEV, MODELS_TOTAL, MODEL_BUILD_MIN_WEEKS, MODEL_BUILD_MAX_WEEKS,
+                                 MODEL_MONITOR_MIN_WEEKS, MODEL_MONITOR_MAX_WEEKS)
 
-    normal_value = np.random.normal(mean, stdev)
-    inverse_value = 1 / normal_value
-    uniform = np.random.uniform(0,1)
-    if uniform < inverse_value:
-        return True
+iter = 1000
+# Adaptive mode: instead of a fixed iter, run batches of BATCH_SIZE until the 95% CI half-width of each output
+# below is within its target (or MAX_ITERATIONS is reached).  None = always run iter iterations
+PRECISION_TARGETS = None # e.g. {'end_period': 1.0, 'capacity': 0.02, 'failed_monitor_pct': 0.002}
+BATCH_SIZE = 100
+MAX_ITERATIONS = 10000
+WORKERS = 1 # Processes to spread the iterations across.  1 = run in-process, None = one per core
+            # (needs fork: on Windows the iterations always run in-process)
+ENGINE = 'simpy' # 'simpy' is the reference model; 'fast' runs the same model on a plain event calendar (same results);
+                 # 'lockstep' steps all iterations forward together on NumPy arrays (same distributions, own random draws)
+CHECK_ENGINE = False # If True, re-run the iterations on another engine and compare
+CHECKPOINT_FILENAME = None # e.g. 'staffing-results.sqlite'.  Saves every iteration as it finishes (simpy / fast
+                           # engines); re-running skips the (scenario, seed, iteration)s already saved
+# Histograms to draw for each scenario: {output: (title, file name prefix)}.  They're drawn in a background
+# process while the runs carry on (in-process where fork isn't available, e.g. Windows)
+REPORT_FIGURES = {
+    'end_period': ('Histogram of Timeframes to Complete All Models', 'Graphs/TimeHist'),
+    'capacity': ('Histogram of available FTE once all models built', 'Graphs/FTEHist'),
+    'failed_monitor_pct': ('Histogram of Pct of Model Monitoring that failed', 'Graphs/FailHist'),
+}
+REPORT_SWEEP = False # If True, also draw the histograms for every scenario in the sweep
+TRACE = False # Re-run iteration 0 with tracing on: event counts / time per process type and a Chrome trace file
+
+store = ResultStore(CHECKPOINT_FILENAME) if CHECKPOINT_FILENAME else None
+if PRECISION_TARGETS:
+    precise_run = run_until_precise(staffing_params, PRECISION_TARGETS, BATCH_SIZE, MAX_ITERATIONS, seed, WORKERS, ENGINE,
+                                    store=store)
+    if not precise_run.converged:
+        print('Precision targets not met after MAX_ITERATIONS: ', precise_run.half_widths)
+    iter_results = precise_run.results
+    iter = len(iter_results)
+else:
+    iter_results = run_iterations(staffing_params, iter, seed, WORKERS, engine=ENGINE, store=store)
+if CHECK_ENGINE:
+    other_results = run_iterations(staffing_params, iter, seed, WORKERS, engine='fast' if ENGINE == 'simpy' else 'simpy')
+    if ENGINE == 'lockstep':
+        # Different random draws, so only the distributions can be compared
+        print(compare_engines(iter_results, other_results))
     else:
-        return False
+        print('Iterations where the engines differ: ', sum(a != b for a, b in zip(iter_results, other_results)))
 
-def sample_uniform(min, max):
-    # This function takes in a min and max range and spits out a random selection
-    # The +/- 0.5 is to ensure equal representation for the endcap values
-    return round(np.random.uniform(min-0.5, max+0.5),0)
-
-def target_quarter(today, num_quarters_from_now):
-    # Function takes in the current week number and spits out the start of a future quarter
-    days_into_quarter = today % 13
-    target_date = today - days_into_quarter + num_quarters_from_now * 13 + 1
-    return(target_date)
-
-def weeks_until_target_quarter(today, num_quarters_from_now):
-    target_week = target_quarter(today, num_quarters_from_now)
-    return(target_week - today)
+# One row per iteration, one column per output: iter_records['end_period'] etc
+iter_records = results_array(iter_results)
 
+print ('DONE WITH THE SCENARIO RUNS!')
 #%%
+# Summary quantiles and histograms of the outputs.  The figures are drawn in the background
+report_worker = ReportWorker()
 
-def setup_staff(env):
-    # We have a certain number of modelers as resources, with the resource volume defined as target team size
-    # However, when we start our simulation we aren't at target team size
-    # So we do this initial setup to essentially "fire" all of the excess employees
-    num_modelers_to_fire = MODELER_TO_HIRE_SIZE
-    for i in range(num_modelers_to_fire):
-        env.process(fire_staff(env))
-    yield env.timeout(0)
-
-
-def fire_staff(env):
-    global counter_fired, counter_hired
-    with modeler_beach.request(priority=priority_fire) as req:
-        yield req
-        counter_fired = counter_fired + 1
-        weeks_remaining = max(1,round(np.random.normal(HIRING_MEAN, HIRING_SDEV),0))
-#        print('Fired staff.  Will hire again in # weeks:', weeks_remaining)
-        # Note: we use the hiring mean/sdev because that's the time necessary to hire a fired employee
-        yield env.timeout(weeks_remaining)
-        counter_hired = counter_hired + 1
-#        print('Hired a new employee at time ', env.now)
-
-def staff_management(env):
-    # This process controls the hiring and quitting of modeling staff.
-    # Two potential events can happen: a new employee can be hired, and an existing employee could quit
-    # We are tracking two containers: modeler_beach and modeler_to_hire:
-    # The beach tracks existing staff levels, "to_hire" is a pool of modelers that we could hire
-    #
-    while True:
-        if (test_normal(QUITTING_MEAN, QUITTING_SDEV)):     # Test whether this is the week someone quits
-#            print('A modeler just quit!  Sad face')
-            env.process(fire_staff(env))
-        yield env.timeout(1)
-
-class Model(object):
-    def __init__(self, env, name):
-        self.env = env
-        self.name = name
-
-        self.process = env.process(self.build_model(name, 'build', 5, DURATION, priority_build))
-
-    def build_model(self, name, build_or_rebuild, week_start_after, week_start_by, given_priority):
-        # Name is self-evident.  It's the model number
-        # Build or rebuild is just a text field to help with reporting.  Has no impact on anything
-        # week_start_after is the number in the simulation when the model can begin being worked on.
-        #   Note that this needs to get translated into a "weeks from now" measure for use in simpy
-        # week_start_by is the number in the simulation when the model must start being worked on otherwise
-        #   There's a risk that the model won't be done in time
-        # Given Priority is a variable set earlier.  Build is lowest priority, then monitor, then rebuild
-
-        # Translate the week variables from straight periods in the simulation to "weeks from now"
-        global counter_models_completed, counter_failed_rebuilds
-        weeks_until_start = max(0, week_start_after - env.now)
-        weeks_until_deadline = max(0, week_start_by - env.now - MODEL_BUILD_MAX_WEEKS)
-#        print('In Build Model.  Modelers available: ', modeler_beach.capacity - modeler_beach.count)
-        yield env.timeout(weeks_until_start)
-        with modeler_beach.request(priority=given_priority) as req:
-            results = yield req | env.timeout(weeks_until_deadline)
-            if req in results:
-                model_build_weeks = sample_uniform(MODEL_BUILD_MIN_WEEKS, MODEL_BUILD_MAX_WEEKS)
-#                print('%d: Modeler assigned to %s %s for %d weeks' % (env.now, build_or_rebuild, name, model_build_weeks))
-#                print('There are now %d modelers' % (modeler_beach.capacity - modeler_beach.count))
-                yield env.timeout(model_build_weeks)
-                yield modeler_beach.release(req)
-#                print('%d: %s %s complete; modeler released' % (env.now, build_or_rebuild, name))
-#                print('There are now %d modelers' % (modeler_beach.capacity - modeler_beach.count))
-                # If this was a build (and not a rebuild), increment the models active counter
-                if build_or_rebuild == 'build':
-                    counter_models_completed += 1
-                # Next set of code sets up rebuilding the model
-                # Rebuilding the model builds a number of follow-up events:
-                #   1. A Rebuild Model step, which can start 6 quarters from now and needs to end by 12 quarters from now
-                s_delay = 6
-                e_delay = 12
-                #   2. Six Monitor Models steps, which need to start in each of the following quarters and end by quarter-end
-
-                # 1. Rebuild Model step
-                # Figure out the inputs
-                # 1a. If the model is finished in, say, quarter 3, then new model can start being worked on
-                #     at the beginning of quarter 10 and must be finished by the start of quarter 16
-                rebuild_start_after = target_quarter(env.now,s_delay + 1)
-                rebuild_finish_by = target_quarter(env.now, e_delay + 1)
-                rebuild = self.build_model(name, 'rebuild',rebuild_start_after, rebuild_finish_by, priority_rebuild)
-                for i in range(1, s_delay+1):
-#                    print('In monitoring loop for %s,  step # %d' %(name, i))
-                    monitor_start_after = target_quarter(env.now, 1)
-                    monitor_finish_by = target_quarter(env.now, 2)
-                    monitor = self.monitor_model(name, monitor_start_after, monitor_finish_by, priority_monitor)
-                    yield env.process(monitor)
-                yield env.process(rebuild)
-
-            else:
-                counter_failed_rebuilds += 1
-#                print('%s failed to be worked on in the deadline. %d total failed rebuilds' % (name, counter_failed_rebuilds))
-
-    def monitor_model(self, name, week_start_after, week_start_by, given_priority):
-        global counter_failed_monitors
-        # Monitor model doesn't carry the baggage of triggering follow-on events
-        # So the drivers are very similar to what we see in the build model world
-        weeks_until_start = max(0, week_start_after - env.now)
-        weeks_until_deadline = max(0, week_start_by - env.now - MODEL_MONITOR_MAX_WEEKS)
-#        print('In Monitor %s.  Modelers available: %d' %( name, modeler_beach.capacity - modeler_beach.count))
-        yield env.timeout(weeks_until_start)
-        with modeler_beach.request(priority=given_priority) as req:
-            results = yield req | env.timeout(weeks_until_deadline)
-            if req in results:
-                model_monitor_weeks = sample_uniform(MODEL_MONITOR_MIN_WEEKS, MODEL_MONITOR_MAX_WEEKS)
-#                print('%d: Modeler assigned to MONITOR %s for %d weeks' % (env.now, name, model_monitor_weeks))
-#                print('There are now %d modelers' % (modeler_beach.capacity - modeler_beach.count))
-                yield env.timeout(model_monitor_weeks)
-                yield modeler_beach.release(req)
-#                print('%d: MONITOR %s complete; modeler released' % (env.now, name))
-#                print('There are now %d modelers' % (modeler_beach.capacity - modeler_beach.count))
-
-            else:
-#                print('%s failed to be monitored in the deadline' % name)
-                counter_failed_monitors += 1
+def report_scenario(records, name):
+    summary = summarize_results(records, list(REPORT_FIGURES))
+    report_worker.submit(summary.histograms, {field: title for field, (title, prefix) in REPORT_FIGURES.items()},
+                         {field: prefix + name + '.png' for field, (title, prefix) in REPORT_FIGURES.items()})
+    return summary.quantiles
 
-
-def weekly_reporting(env):
-    global bool_models_all_built, time_models_completed
-    while True:
-        available_modelers = modeler_beach.capacity - modeler_beach.count
-        ds_available_modelers.append(available_modelers)
-        if counter_models_completed == MODELS_TOTAL:
-            ds_available_modelers_at_full_modeling.append(available_modelers)
-
-            if bool_models_all_built == False:
-                bool_models_all_built = True
-                time_models_completed = env.now
-
-        ds_models_completed.append(counter_models_completed)
-        ds_hired.append(counter_hired)
-        ds_fired.append(counter_fired)
-        yield env.timeout(1)
+print(report_scenario(iter_records, scenario_name))
 
 #%%
-# Create environment and start processes
-ds_iter_hired = []
-ds_iter_fired = []
-ds_iter_failed_rebuilds = []
-ds_iter_failed_monitors = []
-ds_iter_failed_monitor_pct = []
-ds_iter_end_period = []
-ds_iter_capacity = []
-
-iter = 1000
-
-for i in range(iter):
-    if i % 50 == 0:
-        print('Iteration %d' % i)
-    # Setup counters etc
-    # Reporting Metrics
-    counter_fired = 0
-    counter_hired = 0
-    counter_failed_rebuilds = 0
-    counter_failed_monitors = 0
-    counter_models_completed = 0
-    bool_models_all_built = False
-    time_models_completed = DURATION
-
-    ds_fired = [0]
-    ds_hired = [0]
-    ds_models_completed = [0]
-    ds_available_modelers = [0]
-    ds_available_modelers_at_full_modeling = [0]
-
-    # Run environment
-    env = simpy.Environment()
-    modeler_beach = simpy.PriorityResource(env, capacity = MODELER_TARGET_TEAM_SIZE)
-    env.process(setup_staff(env))
-    env.process(staff_management(env))
-    env.process(weekly_reporting(env))
-    models = [Model(env, 'Model %d' % i) for i in range(1,MODELS_TOTAL+1)]
-    env.run(until=DURATION)
-
-    # Report results
-#    avg_capacity = round(mean(ds_available_modelers),3)
-    avg_capacity_at_full_modeling = round(mean(ds_available_modelers_at_full_modeling),3)
+# Scenario sweep.  Every cell x iteration goes into one job queue across the WORKERS, biggest cells first
+if SWEEP:
+    df_sweep = run_sweep(staffing_params, iter, SWEEP_TEAM_SIZES, SWEEP_MODEL_COUNTS,
+                         [(low * 4, high * 4) for low, high in SWEEP_BUILD_MONTHS], SWEEP_MONITOR_WEEKS,
+                         seed, WORKERS, engine=ENGINE, store=store)
+    df_sweep.to_csv(SWEEP_FILENAME, index=False)
+    print(df_sweep.groupby('scenario_name')[['end_period', 'capacity', 'failed_monitor_pct']].mean())
+    if REPORT_SWEEP:
+        for name, df_cell in df_sweep.groupby('scenario_name'):
+            report_scenario(df_cell.to_records(index=False), name)
 
-    monitor_attempts = MODELS_TOTAL * ((DURATION / 52) - 1) * 4
-    failed_monitor_percentage = round(counter_failed_monitors / monitor_attempts,2)
-
-    ds_iter_hired.append(counter_hired)
-    ds_iter_fired.append(counter_fired)
-    ds_iter_failed_rebuilds.append(counter_failed_rebuilds)
-    ds_iter_failed_monitors.append(counter_failed_monitors)
-    ds_iter_failed_monitor_pct.append(failed_monitor_percentage)
-    ds_iter_end_period.append(time_models_completed)
-    ds_iter_capacity.append(avg_capacity_at_full_modeling)
-
-#    print('hired / fired', counter_hired, counter_fired)
-#    print('Failed rebuilds / monitors', counter_failed_rebuilds, counter_failed_monitors)
-#    print('Failed monitor percentage', failed_monitor_percentage, monitor_attempts)
-#    print('Did all models finish (true/false) and if so, in what period', bool_models_all_built, time_models_completed)
-#    print('Avg FTE capacity and after full modeling', avg_capacity, avg_capacity_at_full_modeling)
-
-print ('DONE WITH THE SCENARIO RUNS!')
 #%%
-# Create histogram of Time to Complete All Models
-df_iter_end_period = pd.DataFrame(ds_iter_end_period)
-
-plt.close()
-timeframe_hist = df_iter_end_period.plot.hist(density=True, alpha=0.6, color='b')
-plt.title('Histogram of Timeframes to Complete All Models')
-fig = plt.gcf()
-filename = 'Graphs/TimeHist' + scenario_name + '.png'
-fig.savefig(filename)
-plt.close()
+# Multi-team run.  One row per iteration and team
+if TEAMS:
+    df_teams = run_teams(staffing_params, TEAMS, iter, seed, RECRUITERS, BORROWING)
+    df_teams.to_csv(TEAMS_FILENAME, index=False)
+    print(df_teams.groupby('team')[['end_period', 'capacity', 'failed_monitor_pct', 'borrowed']].mean())
 
 #%%
-# Create histogram of FTE capacity
-df_iter_capacity = pd.DataFrame(ds_iter_capacity)
-
-plt.close()
-capacity_hist = df_iter_capacity.plot.hist(density=True, alpha=0.6, color='b')
-plt.title('Histogram of available FTE once all models built')
-fig = plt.gcf()
-filename = 'Graphs/FTEHist' + scenario_name + '.png'
-fig.savefig(filename)
-plt.close()
+# Team size search.  Bisects on team size, with BATCH_SIZE iterations at a time (up to MAX_ITERATIONS) per size
+if OPTIMIZE:
+    team_search = find_min_team_size(staffing_params, OPTIMIZE_THRESHOLD, OPTIMIZE_FIELD, OPTIMIZE_QUANTILE,
+                                     batch_size=BATCH_SIZE, max_iterations=MAX_ITERATIONS, seed=seed,
+                                     workers=WORKERS, engine=ENGINE)
+    print('Smallest team size meeting the target: ', team_search.team_size)
+    print(team_search.evaluations)
 
 #%%
-# Create histogram of failed monitor percentage
-df_iter_failed_monitor_pct = pd.DataFrame(ds_iter_failed_monitor_pct)
-
-plt.close()
-failure_hist = df_iter_failed_monitor_pct.plot.hist(density=True, alpha=0.6, color='b')
-plt.title('Histogram of Pct of Model Monitoring that failed')
-fig = plt.gcf()
-filename = 'Graphs/FailHist' + scenario_name + '.png'
-fig.savefig(filename)
-plt.close()
-
+# Trace of iteration 0 (same seed as in the runs above).  Open the file in chrome://tracing or ui.perfetto.dev
+if TRACE:
+    trace = SimulationTrace()
+    StaffingSimulation(trace).run(np.random.SeedSequence(seed).spawn(1)[0], staffing_params)
+    print(trace.summary())
+    trace.write_chrome_trace('trace-' + scenario_name + '.json')
 
+#%%
+# Wait for the background figures to finish
+print('Figures written: ', report_worker.close())
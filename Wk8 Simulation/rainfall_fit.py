@@ -0,0 +1,92 @@
+import collections
+import hashlib
+import json
+import os
+import numpy as np
+import pandas as pd
+import scipy.stats as stats
+
+# Rainfall distribution fitting for west-assignment-4.py
+# Fitting every candidate distribution with Fitter is the slowest part of starting a run, and the answer only
+# changes when the data does.  Fits are stored on disk keyed by a hash of the CSV and the distribution list,
+# so later runs load the fitted parameters and error summary straight from the cache file.
+# There is also a seasonal model: a zero-inflated gamma per calendar month, turned into inverse-CDF lookup
+# tables so the simulation can sample every month of every scenario with one table lookup.
+
+FIT_CACHE_DIR = 'fit-cache'
+
+# params: {distribution: {'a': ..., 'loc': ..., 'scale': ...}}, same naming as Fitter.get_best
+# errors: Fitter's df_errors (sumsquare_error, aic, bic, ...), one row per distribution
+# fitter: the Fitter object when the fit was just run, None when it came from the cache
+RainfallFit = collections.namedtuple('RainfallFit', ['params', 'errors', 'fitter'])
+
+
+def fit_cache_key(csv_path, distributions):
+    """Hash of the raw CSV bytes plus the distribution list"""
+    digest = hashlib.sha256()
+    with open(csv_path, 'rb') as csv_file:
+        digest.update(csv_file.read())
+    digest.update(json.dumps(list(distributions)).encode())
+    return digest.hexdigest()[:16]
+
+
+def named_params(distribution, fitted):
+    # Same naming Fitter.get_best uses: the scipy shape parameters, then loc and scale
+    shapes = getattr(stats, distribution).shapes
+    param_names = (shapes + ', loc, scale').split(', ') if shapes else ['loc', 'scale']
+    return dict(zip(param_names, [float(p) for p in fitted]))
+
+
+def fit_rainfall_distributions(values, csv_path, distributions, cache_dir=FIT_CACHE_DIR):
+    """Fit each distribution to the values, or load the fit from the cache if the CSV hasn't changed"""
+    cache_path = os.path.join(cache_dir, fit_cache_key(csv_path, distributions) + '.json')
+    if os.path.exists(cache_path):
+        with open(cache_path) as cache_file:
+            cached = json.load(cache_file)
+        errors = pd.DataFrame.from_dict(cached['errors'], orient='index')
+        return RainfallFit(cached['params'], errors, None)
+
+    # Fitter is only imported when we actually need to fit
+    from fitter import Fitter
+    f = Fitter(values, distributions=list(distributions))
+    f.fit()
+    params = {name: named_params(name, f.fitted_param[name]) for name in f.fitted_param}
+    errors = f.df_errors.astype(float)
+
+    os.makedirs(cache_dir, exist_ok=True)
+    with open(cache_path, 'w') as cache_file:
+        json.dump({'csv_path': csv_path, 'distributions': list(distributions),
+                   'params': params, 'errors': errors.to_dict(orient='index')}, cache_file, indent=2)
+    return RainfallFit(params, errors, f)
+
+
+# Seasonal model: p_zero, shape and scale are one entry per month, in CSV column order
+MonthlyRainfallModel = collections.namedtuple('MonthlyRainfallModel', ['months', 'p_zero', 'shape', 'scale'])
+
+
+def fit_monthly_rainfall(df_rainfall):
+    """Fit a zero-inflated gamma to each month's column (the CSV has months with no rain at all)"""
+    # Each month is a point mass at 0 (the share of years with no rain that month) plus a gamma, with loc fixed
+    # at 0, fitted to the years that did get rain
+    p_zero, shapes, scales = [], [], []
+    for month in df_rainfall.columns:
+        values = df_rainfall[month].to_numpy(dtype=float)
+        rainy = values[values > 0]
+        a, loc, scale = stats.gamma.fit(rainy, floc=0)
+        p_zero.append(1 - len(rainy) / len(values))
+        shapes.append(a)
+        scales.append(scale)
+    return MonthlyRainfallModel(list(df_rainfall.columns), np.array(p_zero), np.array(shapes), np.array(scales))
+
+
+def rainfall_lookup_table(model, table_size=8192):
+    """Inverse CDF of each month's rainfall at table_size evenly spaced probabilities.  Shape (12, table_size)"""
+    # Sampling a month is then table[month, int(U * table_size)] for a uniform U.  Probabilities sit at the
+    # middle of each slot, so the far upper tail is cut off at the 1 - 1/(2 * table_size) quantile
+    u = (np.arange(table_size) + 0.5) / table_size
+    table = np.zeros((len(model.months), table_size))
+    for m in range(len(model.months)):
+        p_zero = model.p_zero[m]
+        wet = u > p_zero
+        table[m, wet] = stats.gamma.ppf((u[wet] - p_zero) / (1 - p_zero), model.shape[m], scale=model.scale[m])
+    return table
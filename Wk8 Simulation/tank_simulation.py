@@ -0,0 +1,602 @@
+import collections
+import itertools
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+import pandas as pd
+import scipy.stats as stats
+import simpy
+
+# Simulation engines for the rainwater tank model in west-assignment-4.py
+# The SimPy engine is the reference: it walks one scenario at a time through monthly_rain / monthly_watering.
+# Each scenario is self-contained (its own seed and params), so scenarios can be farmed out to a process pool.
+# The vectorized engine draws every month of every scenario up front as (ITERATIONS, DURATION) arrays
+# and then walks all of the scenarios forward together, one month per NumPy step.
+
+# Everything the engine needs to know about a scenario.  Field names mirror the constants in the script
+TankParams = collections.namedtuple('TankParams', [
+    'tank_size',                # Gallons (WATER_TANK_SIZE)
+    'tank_init',                # Gallons (WATER_TANK_INIT)
+    'catchment_efficiency',     # [min, max] percent (CATCHMENT_EFFICIENCY)
+    'catchment_size',           # Sq. Ft. (CATCHMENT_SIZE)
+    'cubic_ft_to_gal',          # CUBIC_FT_TO_GAL
+    'water_usage',              # [min, max] gallons per month (WATER_USAGE)
+    'duration',                 # Months (DURATION)
+    'climate_change_haircut',   # CLIMATE_CHANGE_HAIRCUT
+    'shape',                    # Fitted gamma shape (alpha)
+    'scale',                    # Fitted gamma scale (1 / beta)
+    'rainfall_table',           # Optional seasonal inverse-CDF table, (12, table_size).  None = the single gamma
+], defaults=(None,))
+
+# What the script reports off of the results buffer
+TankSummary = collections.namedtuple('TankSummary', [
+    'min_water',                # Min water per scenario (df_minwater['min'])
+    'n_zeros',                  # Number of scenarios that ran out of water
+    'min_water_percentiles',    # Percentiles of min water across scenarios
+    'monthly_percentiles',      # Percentiles of the tank level across scenarios, one column per month
+])
+
+# Failure probability estimate from estimate_failure_probability
+FailureEstimate = collections.namedtuple('FailureEstimate', [
+    'fail_pct',                 # Estimated probability a scenario runs out of water
+    'std_error',                # Standard error of fail_pct
+    'effective_sample_size',    # Plain Monte Carlo scenarios needed for the same standard error
+    'iterations',               # Scenarios actually simulated
+])
+
+# Failure probability estimate from estimate_failure_probability_importance
+ImportanceEstimate = collections.namedtuple('ImportanceEstimate', [
+    'fail_pct',                 # Unbiased estimate of the probability a scenario runs out of water
+    'std_error',                # Standard error of fail_pct
+    'ci_low',                   # 95% confidence bounds on fail_pct
+    'ci_high',
+    'tilt',                     # Rainfall scale multiplier used for sampling (1 = plain Monte Carlo)
+    'n_failures',               # Failures seen under the tilted sampling
+    'iterations',               # Scenarios simulated in the final (estimation) run
+])
+
+
+# Results buffer
+
+def allocate_tanklevels(duration, iterations, memmap_path=None):
+    """Preallocate the (DURATION+1, ITERATIONS) float32 results buffer, optionally backed by a .npy file on disk"""
+    # Every engine writes its scenarios straight into this buffer, one column per scenario.
+    # float32 is plenty for gallons and halves the memory; with memmap_path the buffer lives on disk
+    # (reload later with np.load(memmap_path, mmap_mode='r')) so million-scenario runs don't need the RAM
+    shape = (duration + 1, iterations)
+    if memmap_path is None:
+        return np.zeros(shape, dtype=np.float32)
+    return np.lib.format.open_memmap(memmap_path, mode='w+', dtype=np.float32, shape=shape)
+
+
+def summarize_tanklevels(tanklevels, percentiles=(5, 25, 50, 75, 95)):
+    """Compute min water, failure count and percentiles directly on the results buffer"""
+    # Monthly percentiles are taken one month (row) at a time so a memmapped buffer is never pulled
+    # into memory all at once
+    min_water = tanklevels.min(axis=0)
+    n_zeros = int(np.count_nonzero(min_water == 0))
+    min_water_percentiles = np.percentile(min_water, percentiles)
+    monthly_percentiles = np.empty((len(percentiles), tanklevels.shape[0]))
+    for month in range(tanklevels.shape[0]):
+        monthly_percentiles[:, month] = np.percentile(tanklevels[month], percentiles)
+    return TankSummary(min_water, n_zeros, min_water_percentiles, monthly_percentiles)
+
+
+# SimPy engine (reference)
+
+def monthly_rain(env, water_tank, rng, params):
+    """ Every month a volume of rain falls.  The rain is put into the storage tank"""
+    if params.rainfall_table is None:
+        rainfall_level_inches = rng.gamma(params.shape, params.scale)
+    else:
+        rainfall_level_inches = lookup_rainfall(params.rainfall_table, env.now, rng.random())
+    rainfall_catchment_pct = rng.integers(params.catchment_efficiency[0], params.catchment_efficiency[1] + 1) / 100
+    rainfall_capture_gallons = rainfall_gallons(rainfall_level_inches, rainfall_catchment_pct, params)
+    tank_gap = water_tank.capacity - water_tank.level
+    amount = min(tank_gap, rainfall_capture_gallons) # This ensures the tank won't overflow
+    if amount > 0: # Container.put rejects 0, which the seasonal model's dry months produce
+        yield water_tank.put(amount)
+
+
+def monthly_watering(env, water_tank, rng, params):
+    water_used = rng.integers(params.water_usage[0], params.water_usage[1] + 1)
+    yield water_tank.get(water_used)
+
+
+def month_control(env, water_tank, rng, params, tanklevel):
+    """Drive the monthly process of triggering monthly rains and then triggering monthly crop watering"""
+    # If the tank can't cover a month's watering the get never fires, so the rest of tanklevel stays at 0
+    while True:
+        yield env.process(monthly_rain(env, water_tank, rng, params))
+        yield env.process(monthly_watering(env, water_tank, rng, params))
+        tanklevel[env.now + 1] = water_tank.level
+        yield env.timeout(1)
+
+
+def run_scenario(seed, params):
+    """Run one SimPy scenario.  Returns the tank level for months 0..DURATION"""
+    rng = np.random.default_rng(seed)
+    env = simpy.Environment()
+    water_tank = simpy.Container(env, params.tank_size, init=params.tank_init)
+    tanklevel = np.zeros(params.duration + 1)
+    tanklevel[0] = params.tank_init
+    env.process(month_control(env, water_tank, rng, params, tanklevel))
+    env.run(until=params.duration)
+    return tanklevel
+
+
+def _run_shard(seeds, params):
+    # Worker side of run_scenarios: one column per scenario, same layout as df_tanklevel
+    tanklevels = np.zeros((params.duration + 1, len(seeds)), dtype=np.float32)
+    for i, seed in enumerate(seeds):
+        tanklevels[:, i] = run_scenario(seed, params)
+    return tanklevels
+
+
+def run_scenarios(params, iterations, seed=None, workers=1, memmap_path=None):
+    """Run every scenario with the SimPy engine, optionally spread across a process pool"""
+    # Every scenario gets its own child of one SeedSequence, so results only depend on the seed,
+    # not on how many workers there are or how the scenarios were sharded between them.
+    # Shards come back as column blocks that are written straight into the preallocated results buffer.
+    seeds = np.random.SeedSequence(seed).spawn(iterations)
+    tanklevels = allocate_tanklevels(params.duration, iterations, memmap_path)
+    if workers is None:
+        workers = os.cpu_count()
+    # Fork keeps the workers from re-running the calling script on start-up.  The script has no __main__ guard,
+    # so under spawn (the only option on Windows) every worker would re-run it: run in-process instead
+    mp_context = multiprocessing.get_context('fork') if 'fork' in multiprocessing.get_all_start_methods() else None
+    if workers > 1 and mp_context is None:
+        print('No fork start method on this platform; running the scenarios in-process')
+        workers = 1
+    if workers <= 1:
+        for i in range(iterations):
+            tanklevels[:, i] = run_scenario(seeds[i], params)
+            if (i + 1) % 50 == 0:
+                print('On scenario # %d' % (i + 1))
+        return tanklevels
+
+    # Several shards per worker so a slow shard doesn't leave the other cores idle at the end
+    shards = [shard for shard in np.array_split(np.arange(iterations), workers * 4) if len(shard)]
+    with ProcessPoolExecutor(max_workers=workers, mp_context=mp_context) as pool:
+        futures = {pool.submit(_run_shard, [seeds[i] for i in shard], params): shard for shard in shards}
+        done = 0
+        for future in as_completed(futures):
+            shard = futures[future]
+            tanklevels[:, shard[0]:shard[-1] + 1] = future.result()
+            done += len(shard)
+            print('Finished %d of %d scenarios' % (done, iterations))
+    return tanklevels
+
+
+# Vectorized engine
+
+def lookup_rainfall(rainfall_table, months, u):
+    """Seasonal rainfall: inverse-CDF table lookup for months since the start of the run (month 0 = January)"""
+    slot = (np.asarray(u) * rainfall_table.shape[1]).astype(np.int64)
+    return rainfall_table[np.asarray(months) % len(rainfall_table), slot]
+
+
+def draw_rainfall(rng, params, months, n):
+    """Rainfall in inches for n scenarios over the given months, shaped (n, len(months))"""
+    if params.rainfall_table is None:
+        return rng.gamma(params.shape, params.scale, (n, len(months)))
+    return lookup_rainfall(params.rainfall_table, months, rng.random((n, len(months))))
+
+
+def draw_monthly_inputs(rng, params, iterations):
+    """Draw the rainfall, catchment efficiency and water usage for every month of every scenario"""
+    # Same distributions as monthly_rain / monthly_watering:
+    #   rainfall is gamma (or the seasonal table), catchment efficiency and usage are discrete uniforms
+    #   (randint is inclusive on both ends)
+    size = (iterations, params.duration)
+    rainfall_inches = draw_rainfall(rng, params, np.arange(params.duration), iterations)
+    catchment_pct = rng.integers(params.catchment_efficiency[0], params.catchment_efficiency[1] + 1, size) / 100
+    water_used = rng.integers(params.water_usage[0], params.water_usage[1] + 1, size)
+    return rainfall_inches, catchment_pct, water_used
+
+
+def rainfall_gallons(rainfall_inches, catchment_pct, params):
+    # Same conversion chain as monthly_rain: inches of rain -> captured inches -> cubic feet -> gallons
+    rainfall_capture_inches = rainfall_inches * (1 - params.climate_change_haircut) * catchment_pct
+    rainfall_capture_cubicft = rainfall_capture_inches * params.catchment_size / 12
+    return rainfall_capture_cubicft * params.cubic_ft_to_gal
+
+
+def tank_recursion(rain_gallons, water_used, params, out=None):
+    """Walk every scenario's tank forward month by month.  Returns levels shaped (DURATION+1, ITERATIONS)"""
+    # Each month the rain tops up the tank (capped at capacity), then the crops are watered.
+    # In the SimPy version a watering the tank can't cover blocks forever, so the scenario stops and
+    # every later month is reported as 0.  Here a failed scenario is pinned at 0 for the rest of the run.
+    # The level is carried in float64 and only stored in the (float32) buffer
+    iterations, duration = rain_gallons.shape
+    tanklevels = allocate_tanklevels(duration, iterations) if out is None else out
+    level = np.full(iterations, float(params.tank_init))
+    failed = np.zeros(iterations, dtype=bool)
+    tanklevels[0] = level
+    for month in range(duration):
+        level = np.minimum(level + rain_gallons[:, month], params.tank_size) - water_used[:, month]
+        failed |= level < 0
+        level[failed] = 0
+        tanklevels[month + 1] = level
+    return tanklevels
+
+
+def chunked_monthly_inputs(params, iterations, seed=None, chunk_size=None):
+    """Yield (start, stop, rain_gallons, water_used) for successive chunks of scenarios"""
+    # chunk_size bounds how many scenarios' draws are held in memory at once.  Each chunk has its own child seed,
+    # so results depend on the seed and the chunk size
+    chunk_size = chunk_size or iterations
+    chunk_starts = range(0, iterations, chunk_size)
+    chunk_seeds = np.random.SeedSequence(seed).spawn(len(chunk_starts))
+    for start, chunk_seed in zip(chunk_starts, chunk_seeds):
+        stop = min(start + chunk_size, iterations)
+        rng = np.random.default_rng(chunk_seed)
+        rainfall_inches, catchment_pct, water_used = draw_monthly_inputs(rng, params, stop - start)
+        yield start, stop, rainfall_gallons(rainfall_inches, catchment_pct, params), water_used
+
+
+def simulate_tanklevels(params, iterations, seed=None, memmap_path=None, chunk_size=None):
+    """Run all scenarios with the vectorized engine.  Same layout as df_tanklevel (row = month, column = scenario)"""
+    tanklevels = allocate_tanklevels(params.duration, iterations, memmap_path)
+    for start, stop, rain_gallons, water_used in chunked_monthly_inputs(params, iterations, seed, chunk_size):
+        tank_recursion(rain_gallons, water_used, params, out=tanklevels[:, start:stop])
+    return tanklevels
+
+
+# Streaming statistics
+
+class TankLevelStats(object):
+    """Running statistics over tank trajectories, fed one chunk of scenarios at a time"""
+    # Memory is fixed by DURATION and n_bins, not by the number of scenarios:
+    #   - per-month mean / variance, merged chunk by chunk with Welford's (Chan's) update
+    #   - per-month histograms of the tank level, used as the quantile sketch.  Levels are bounded by the tank size,
+    #     so fixed bins give quantiles to within one bin width (tank_size / n_bins) and merge by simple addition.
+    #     Empty tanks are counted exactly, outside the histogram, so failure-driven quantiles come out exactly 0
+    #   - the same histogram and zero count for each scenario's min water
+    #   - the first n_paths trajectories, for the time series graph
+    def __init__(self, duration, tank_size, n_paths=20, n_bins=1000):
+        self.count = 0
+        self.mean = np.zeros(duration + 1)
+        self.m2 = np.zeros(duration + 1)
+        self.bin_edges = np.linspace(0, tank_size, n_bins + 1)
+        self.level_zeros = np.zeros(duration + 1, dtype=np.int64)
+        self.level_hist = np.zeros((duration + 1, n_bins), dtype=np.int64)
+        self.min_water_zeros = 0
+        self.min_water_hist = np.zeros(n_bins, dtype=np.int64)
+        self.n_paths = n_paths
+        self.sample_paths = np.zeros((duration + 1, 0), dtype=np.float32)
+
+    def update(self, tanklevels):
+        """Fold in a (DURATION+1, n) block of scenarios"""
+        n = tanklevels.shape[1]
+        if n == 0:
+            return
+        batch_mean = tanklevels.mean(axis=1, dtype=np.float64)
+        batch_m2 = ((tanklevels - batch_mean[:, None]) ** 2).sum(axis=1)
+        delta = batch_mean - self.mean
+        total = self.count + n
+        self.mean += delta * n / total
+        self.m2 += batch_m2 + delta ** 2 * self.count * n / total
+        self.count = total
+
+        self.level_zeros += np.count_nonzero(tanklevels == 0, axis=1)
+        self.level_hist += self._histogram(tanklevels)
+        min_water = tanklevels.min(axis=0)
+        self.min_water_zeros += int(np.count_nonzero(min_water == 0))
+        self.min_water_hist += self._histogram(min_water[None, :])[0]
+
+        if self.sample_paths.shape[1] < self.n_paths:
+            keep = self.n_paths - self.sample_paths.shape[1]
+            self.sample_paths = np.hstack([self.sample_paths, tanklevels[:, :keep].astype(np.float32)])
+
+    def _histogram(self, levels):
+        # One histogram per row of levels, ignoring exact zeros (those are counted separately)
+        n_bins = len(self.bin_edges) - 1
+        bins = np.clip((levels / self.bin_edges[-1] * n_bins).astype(np.int64), 0, n_bins - 1)
+        bins += (np.arange(levels.shape[0]) * n_bins)[:, None]
+        counts = np.bincount(bins[levels > 0], minlength=levels.shape[0] * n_bins)
+        return counts.reshape(levels.shape[0], n_bins)
+
+    def _quantiles(self, zeros, hist, percentiles):
+        # Quantiles (rows x percentiles) from exact zero counts plus a histogram, interpolating within the bin
+        cumulative = zeros[:, None] + np.cumsum(hist, axis=1)
+        bin_width = self.bin_edges[1] - self.bin_edges[0]
+        quantiles = np.zeros((hist.shape[0], len(percentiles)))
+        for j, p in enumerate(percentiles):
+            target = p / 100 * self.count
+            b = np.minimum((cumulative < target).sum(axis=1), hist.shape[1] - 1)
+            rows = np.arange(hist.shape[0])
+            below = np.where(b > 0, cumulative[rows, b - 1], zeros)
+            in_bin = np.maximum(hist[rows, b], 1)
+            fraction = np.clip((target - below) / in_bin, 0, 1)
+            quantiles[:, j] = np.where(target <= zeros, 0, self.bin_edges[b] + fraction * bin_width)
+        return quantiles
+
+    @property
+    def std(self):
+        return np.sqrt(self.m2 / max(self.count - 1, 1))
+
+    def summarize(self, percentiles=(5, 25, 50, 75, 95)):
+        """Same TankSummary as summarize_tanklevels.  Per-scenario min water isn't kept, so min_water is None"""
+        min_water_percentiles = self._quantiles(np.array([self.min_water_zeros]), self.min_water_hist[None, :],
+                                                percentiles)[0]
+        monthly_percentiles = self._quantiles(self.level_zeros, self.level_hist, percentiles).T
+        return TankSummary(None, self.min_water_zeros, min_water_percentiles, monthly_percentiles)
+
+
+def simulate_streaming(params, iterations, seed=None, chunk_size=10000, n_paths=20, n_bins=1000):
+    """Run the vectorized engine chunk by chunk, keeping only running statistics (TankLevelStats)"""
+    # Uses the same chunks and seeds as simulate_tanklevels, so with the same chunk_size the scenarios are identical
+    tank_stats = TankLevelStats(params.duration, params.tank_size, n_paths, n_bins)
+    chunk_size = min(chunk_size, iterations)
+    tanklevels = allocate_tanklevels(params.duration, chunk_size)
+    for start, stop, rain_gallons, water_used in chunked_monthly_inputs(params, iterations, seed, chunk_size):
+        chunk = tanklevels[:, :stop - start]
+        tank_recursion(rain_gallons, water_used, params, out=chunk)
+        tank_stats.update(chunk)
+    return tank_stats
+
+
+# First passage (time to first empty)
+
+NEVER_EMPTY = -1 # first_empty value for scenarios that never run dry
+
+
+def first_passage_times(params, iterations, seed=None):
+    """Month each scenario first runs dry (the first df_tanklevel row that hits 0), NEVER_EMPTY if it never does"""
+    # Scenarios stop being simulated the month they fail, and the run stops as soon as every scenario has failed.
+    # Draws are made month by month for the scenarios that are still going, so failed scenarios cost nothing -
+    # which matters in the high-failure configurations (e.g. the 3k roof / 25k tank case, where every scenario fails)
+    rng = np.random.default_rng(seed)
+    first_empty = np.full(iterations, NEVER_EMPTY)
+    active = np.arange(iterations)
+    level = np.full(iterations, float(params.tank_init))
+    for month in range(params.duration):
+        rainfall_inches = draw_rainfall(rng, params, [month], len(active))[:, 0]
+        catchment_pct = rng.integers(params.catchment_efficiency[0], params.catchment_efficiency[1] + 1, len(active)) / 100
+        water_used = rng.integers(params.water_usage[0], params.water_usage[1] + 1, len(active))
+        rain_gallons = rainfall_gallons(rainfall_inches, catchment_pct, params)
+        level = np.minimum(level + rain_gallons, params.tank_size) - water_used
+        failed = level < 0
+        first_empty[active[failed]] = month + 1
+        active = active[~failed]
+        level = level[~failed]
+        if len(active) == 0:
+            break
+    return first_empty
+
+
+def first_empty_months(tanklevels):
+    """Same as first_passage_times, but read off a full results buffer (e.g. from the SimPy engine)"""
+    # Month 0 is the starting level, so look for the first 0 from month 1 on
+    is_empty = tanklevels[1:] == 0
+    return np.where(is_empty.any(axis=0), is_empty.argmax(axis=0) + 1, NEVER_EMPTY)
+
+
+def survival_curve(first_empty, duration):
+    """Share of scenarios that still have water at the end of each month 0..DURATION"""
+    # A scenario survives month t if it first ran dry after t, or never ran dry
+    failure_month = np.where(first_empty == NEVER_EMPTY, duration + 1, first_empty)
+    failures_by_month = np.bincount(failure_month, minlength=duration + 2)[:duration + 1]
+    return 1 - np.cumsum(failures_by_month) / len(first_empty)
+
+
+# Variance reduction for the failure probability
+
+def draw_monthly_inputs_antithetic(rng, params, iterations):
+    """Like draw_monthly_inputs, but scenario i + iterations/2 is the antithetic mirror of scenario i"""
+    # Every input is drawn by inverse CDF from a uniform U, and the mirror scenario uses 1 - U.
+    # A wet scenario is paired with a dry one, so the pair average varies much less than two independent draws
+    n_pairs = iterations // 2
+    # (Clipped away from 0 and 1 so the mirrored gamma draw can't come out infinite)
+    u = np.clip(rng.random((3, n_pairs, params.duration)), 1e-12, 1 - 1e-12)
+    u = np.concatenate([u, 1 - u], axis=1)
+    if params.rainfall_table is None:
+        rainfall_inches = stats.gamma.ppf(u[0], params.shape, scale=params.scale)
+    else:
+        rainfall_inches = lookup_rainfall(params.rainfall_table, np.arange(params.duration), u[0])
+    catchment_pct = discrete_uniform_ppf(u[1], *params.catchment_efficiency) / 100
+    water_used = discrete_uniform_ppf(u[2], *params.water_usage)
+    return rainfall_inches, catchment_pct, water_used
+
+
+def discrete_uniform_ppf(u, low, high):
+    # Inverse CDF of randint(low, high), inclusive on both ends
+    return np.minimum(low + np.floor(u * (high - low + 1)), high)
+
+
+def mean_net_inflow(params):
+    """Analytic mean of each month's rain capture (before the tank cap) minus watering, in gallons"""
+    # Rainfall and catchment efficiency are independent, so the mean of the product is the product of the means.
+    # With the seasonal model every table slot is equally likely, so a month's mean is the mean of its table row
+    if params.rainfall_table is None:
+        mean_rainfall_inches = np.full(params.duration, params.shape * params.scale)
+    else:
+        mean_rainfall_inches = params.rainfall_table.mean(axis=1)[np.arange(params.duration) % len(params.rainfall_table)]
+    mean_catchment_pct = (params.catchment_efficiency[0] + params.catchment_efficiency[1]) / 200
+    mean_water_used = (params.water_usage[0] + params.water_usage[1]) / 2
+    return rainfall_gallons(mean_rainfall_inches, mean_catchment_pct, params) - mean_water_used
+
+
+# Months averaged for each control variate (None = the whole run).  The tank starts part-full, so how wet the
+# first few months were says much more about failure than the 30-year average does
+CONTROL_WINDOWS = (3, 6, 12, 24, None)
+
+
+def estimate_failure_probability(params, iterations, seed=None, antithetic=False, control_variate=False):
+    """Estimate the probability a scenario runs out of water, with its standard error and effective sample size"""
+    # antithetic: scenarios come in mirrored pairs (see draw_monthly_inputs_antithetic), and each pair's average
+    #   is one independent observation.  Uses an even number of scenarios (iterations is rounded down)
+    # control_variate: a scenario's average monthly net inflow over each of CONTROL_WINDOWS has a known mean
+    #   (mean_net_inflow).  Scenarios that happened to be wetter than average fail less often, so the failure
+    #   rate is adjusted (by regression) for how far the sampled inflows landed from their known mean
+    rng = np.random.default_rng(seed)
+    if antithetic:
+        rainfall_inches, catchment_pct, water_used = draw_monthly_inputs_antithetic(rng, params, iterations)
+    else:
+        rainfall_inches, catchment_pct, water_used = draw_monthly_inputs(rng, params, iterations)
+    iterations = len(water_used)
+    rain_gallons = rainfall_gallons(rainfall_inches, catchment_pct, params)
+    failed = (tank_recursion(rain_gallons, water_used, params).min(axis=0) == 0).astype(float)
+    net_inflow = rain_gallons - water_used - mean_net_inflow(params)
+    controls = np.column_stack([net_inflow[:, :window].mean(axis=1) for window in CONTROL_WINDOWS])
+
+    if antithetic:
+        n_pairs = iterations // 2
+        failed = (failed[:n_pairs] + failed[n_pairs:]) / 2
+        controls = (controls[:n_pairs] + controls[n_pairs:]) / 2
+
+    if control_variate and failed.var() > 0:
+        # Regress the failures on the (zero-mean) controls; the intercept is the adjusted estimate
+        design = np.column_stack([np.ones(len(failed)), controls])
+        coefs = np.linalg.lstsq(design, failed, rcond=None)[0]
+        fail_pct = coefs[0]
+        residuals = failed - design @ coefs
+    else:
+        fail_pct = failed.mean()
+        residuals = failed - fail_pct
+        design = failed[:, None]
+
+    n_obs, n_fitted = design.shape
+    fail_pct = min(max(fail_pct, 0), 1)
+    std_error = np.sqrt(np.sum(residuals ** 2) / max(n_obs - n_fitted, 1) / n_obs)
+    # Plain Monte Carlo has variance p(1-p)/n, so this is the n that would match our standard error
+    if std_error > 0:
+        effective_sample_size = fail_pct * (1 - fail_pct) / std_error ** 2
+    else:
+        effective_sample_size = float(iterations)
+    return FailureEstimate(float(fail_pct), float(std_error), float(effective_sample_size), iterations)
+
+
+# Importance sampling for rare failures
+
+def tilted_tank_run(rng, params, iterations, tilt):
+    """Walk every scenario forward with rainfall drawn from gamma(shape, scale * tilt)"""
+    # Returns per scenario: min water (0 = failed), and the number of months and total rainfall up to the month
+    # the min was reached (the month it failed, for failed scenarios).  Those two numbers are all the likelihood
+    # ratio needs, and a failed scenario stops being simulated (and weighted) the month it fails
+    min_level = np.full(iterations, float(params.tank_init))
+    months_at_min = np.zeros(iterations)
+    rain_at_min = np.zeros(iterations)
+    rain_so_far = np.zeros(iterations)
+    level = np.full(iterations, float(params.tank_init))
+    active = np.arange(iterations)
+    for month in range(params.duration):
+        rainfall_inches = rng.gamma(params.shape, params.scale * tilt, len(active))
+        catchment_pct = rng.integers(params.catchment_efficiency[0], params.catchment_efficiency[1] + 1, len(active)) / 100
+        water_used = rng.integers(params.water_usage[0], params.water_usage[1] + 1, len(active))
+        level = np.minimum(level + rainfall_gallons(rainfall_inches, catchment_pct, params), params.tank_size) - water_used
+        rain_so_far[active] += rainfall_inches
+
+        new_min = level < min_level[active]
+        min_level[active[new_min]] = np.maximum(level[new_min], 0)
+        months_at_min[active[new_min]] = month + 1
+        rain_at_min[active[new_min]] = rain_so_far[active[new_min]]
+
+        still_going = level >= 0
+        active = active[still_going]
+        level = level[still_going]
+        if len(active) == 0:
+            break
+    return min_level, months_at_min, rain_at_min
+
+
+def gamma_log_likelihood_ratio(months, rainfall_inches, params, tilt):
+    # log of prod f(x) / g(x) over the months, where f is gamma(shape, scale) and g is gamma(shape, scale * tilt).
+    # It only depends on how many months there were and how much rain fell in total
+    return months * params.shape * np.log(tilt) + rainfall_inches * (1 / tilt - 1) / params.scale
+
+
+def choose_drought_tilt(params, seed=None, pilot_iterations=2000, elite_pct=0.1, max_rounds=10):
+    """Pick the rainfall tilt with the cross-entropy method"""
+    # Each round: simulate a pilot batch, keep the driest elite_pct of scenarios (lowest min water), and move the
+    # sampling scale to the likelihood-weighted average rainfall of those scenarios.  Once the elite reaches
+    # empty tanks, the tilt is targeting the failures themselves
+    rng = np.random.default_rng(seed)
+    tilt = 1.0
+    for _ in range(max_rounds):
+        min_level, months, rainfall = tilted_tank_run(rng, params, pilot_iterations, tilt)
+        threshold = max(np.quantile(min_level, elite_pct), 0)
+        elite = (min_level <= threshold) & (months > 0)
+        if not elite.any():
+            break
+        weights = np.exp(gamma_log_likelihood_ratio(months[elite], rainfall[elite], params, tilt))
+        tilt = np.sum(weights * rainfall[elite]) / (params.shape * np.sum(weights * months[elite])) / params.scale
+        if threshold == 0:
+            break
+    return float(min(tilt, 1.0))
+
+
+def estimate_failure_probability_importance(params, iterations, seed=None, tilt=None, pilot_iterations=2000):
+    """Unbiased failure probability for configurations where failures are too rare for plain Monte Carlo"""
+    # Rainfall is sampled from a drier gamma (scale multiplied by tilt < 1) so failures show up often, and each
+    # failure is weighted by how much less likely its rainfall was under the real gamma.  tilt=None picks it with
+    # a cross-entropy pilot run (choose_drought_tilt), which uses its own random stream.
+    # The tilt and likelihood ratio are for the single fitted gamma, so the seasonal model isn't supported here
+    if params.rainfall_table is not None:
+        raise ValueError('Importance sampling tilts the single fitted gamma; set rainfall_table=None')
+    pilot_seed, run_seed = np.random.SeedSequence(seed).spawn(2)
+    if tilt is None:
+        tilt = choose_drought_tilt(params, pilot_seed, pilot_iterations)
+    rng = np.random.default_rng(run_seed)
+    min_level, months, rainfall = tilted_tank_run(rng, params, iterations, tilt)
+    failed = min_level == 0
+    weighted = np.zeros(iterations)
+    weighted[failed] = np.exp(gamma_log_likelihood_ratio(months[failed], rainfall[failed], params, tilt))
+
+    fail_pct = weighted.mean()
+    std_error = weighted.std(ddof=1) / np.sqrt(iterations)
+    return ImportanceEstimate(float(fail_pct), float(std_error), float(max(fail_pct - 1.96 * std_error, 0)),
+                              float(fail_pct + 1.96 * std_error), tilt, int(failed.sum()), iterations)
+
+
+# Parameter sweep
+
+def sweep_grid(params, iterations, catchment_sizes, tank_sizes, climate_change_haircuts, seed=None,
+               percentiles=(5, 25, 50, 75, 95)):
+    """Run the vectorized engine over the full catchment x tank x haircut grid.  Returns one row per cell"""
+    # Common random numbers: the rainfall, catchment efficiency and usage draws are made once and reused by
+    # every cell, so differences between cells come from the parameters rather than from sampling noise.
+    # Rain in gallons only depends on roof size and haircut, so it is converted once per pair and then
+    # walked through each tank size
+    rng = np.random.default_rng(seed)
+    rainfall_inches, catchment_pct, water_used = draw_monthly_inputs(rng, params, iterations)
+    tanklevels = allocate_tanklevels(params.duration, iterations)
+    rows = []
+    for catchment_size, haircut in itertools.product(catchment_sizes, climate_change_haircuts):
+        cell_params = params._replace(catchment_size=catchment_size, climate_change_haircut=haircut)
+        rain_gallons = rainfall_gallons(rainfall_inches, catchment_pct, cell_params)
+        for tank_size in tank_sizes:
+            cell_params = cell_params._replace(tank_size=tank_size)
+            tank_recursion(rain_gallons, water_used, cell_params, out=tanklevels)
+            min_water = tanklevels.min(axis=0)
+            fail_pct = np.mean(min_water == 0)
+            row = {
+                'catchment_size': catchment_size,
+                'tank_size': tank_size,
+                'climate_change_haircut': haircut,
+                'iterations': iterations,
+                'n_zeros': int(np.count_nonzero(min_water == 0)),
+                'fail_pct': fail_pct,
+                'fail_pct_se': np.sqrt(fail_pct * (1 - fail_pct) / iterations),
+            }
+            for p, value in zip(percentiles, np.percentile(min_water, percentiles)):
+                row['min_water_p%d' % p] = value
+            rows.append(row)
+    return pd.DataFrame(rows).sort_values(['catchment_size', 'tank_size', 'climate_change_haircut'], ignore_index=True)
+
+
+def compare_min_water(reference_min, candidate_min):
+    """Distributional check of one engine against another, using the per-scenario min water"""
+    # The engines use different random streams, so they can only agree in distribution:
+    # compare the failure rates and run a two-sample KS test on the min water levels
+    reference_min = np.asarray(reference_min, dtype=float)
+    candidate_min = np.asarray(candidate_min, dtype=float)
+    ks = stats.ks_2samp(reference_min, candidate_min)
+    return {
+        'reference_fail_pct': float(np.mean(reference_min == 0)),
+        'candidate_fail_pct': float(np.mean(candidate_min == 0)),
+        'ks_statistic': float(ks.statistic),
+        'ks_pvalue': float(ks.pvalue),
+    }
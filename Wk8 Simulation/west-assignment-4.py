@@ -2,9 +2,10 @@ import pandas as pd
 import numpy as np
 import scipy.stats as stats
 import matplotlib.pyplot as plt
-from fitter import Fitter, get_common_distributions
-import random
-import simpy
+from rainfall_fit import fit_rainfall_distributions, fit_monthly_rainfall, rainfall_lookup_table
+from tank_simulation import (TankParams, run_scenarios, simulate_tanklevels, simulate_streaming, summarize_tanklevels,
+                             sweep_grid, first_passage_times, survival_curve, NEVER_EMPTY, estimate_failure_probability,
+                             estimate_failure_probability_importance, compare_min_water)
 
 seed = 460  # Set the random seed for the assignment
 
@@ -12,7 +13,8 @@ seed = 460  # Set the random seed for the assignment
 # Note: per this link: https://www.weather.gov/climateservices/nowdatafaq
 # It seems that the data below is going to be the rainfall measured in inches
 
-df_rainfall = pd.read_csv ('monthly-rainfall-data.csv')
+RAINFALL_CSV = 'monthly-rainfall-data.csv'
+df_rainfall = pd.read_csv (RAINFALL_CSV)
 df_rainfall.set_index('Year', inplace=True)
 
 #%%
@@ -46,21 +48,24 @@ print(df)
 # Note: I tried a handful of different approaches to get the right list here
 # The list below is the Fitter-standard "get common distributions" list, plus beta
 # Given the literature, I wanted to ensure beta was one of the distributions tested, even though it wasn't the best
-f = Fitter(df,
-           distributions= ['gamma','beta','chi2','exponpow','lognorm','expon'])
-f.fit()
-
-print(f.summary())
-fig = plt.gcf()
-fig.savefig('Graphs/RainfallFitter.png')
-plt.close()
+# The fit is cached on disk (fit-cache/), keyed by a hash of the CSV and this list, so it only reruns when either changes.
+# The RainfallFitter graph is only redrawn when the fit actually reruns
+FIT_DISTRIBUTIONS = ['gamma','beta','chi2','exponpow','lognorm','expon']
+rainfall_fit = fit_rainfall_distributions(df, RAINFALL_CSV, FIT_DISTRIBUTIONS)
+
+print(rainfall_fit.errors.sort_values('sumsquare_error'))
+if rainfall_fit.fitter is not None:
+    rainfall_fit.fitter.summary()
+    fig = plt.gcf()
+    fig.savefig('Graphs/RainfallFitter.png')
+    plt.close()
 
 #%%
 # Note: gamma fits the best
 # The code below extracts the data-fit gamma distribution of alpha and scale / beta
 # Note that location is essentially 0.
 
-rf_gamma = f.get_best(method = 'sumsquare_error')['gamma']
+rf_gamma = rainfall_fit.params['gamma']
 
 alpha = rf_gamma['a']
 shape = alpha
@@ -108,79 +113,109 @@ WATER_USAGE = [4000, 5200] # Range of water used to water crops each month
 DURATION = 360 # Number of months in the 30 year forecast
 ITERATIONS = 1000 # Number of scenario runs executed
 CLIMATE_CHANGE_HAIRCUT = 0  # Represents the reduction in rainfall driven by climate change.  0% = problem as stated
+SEASONAL_RAINFALL = False # If True, draw each calendar month from its own zero-inflated gamma instead of the single gamma
+ENGINE = 'simpy' # 'simpy' runs one SimPy scenario at a time (the reference); 'numpy' runs every scenario at once;
+                 # 'streaming' runs the numpy engine in chunks and keeps only running statistics (constant memory)
+CHECK_ENGINE = False # If True, run both engines and compare their min water distributions
+WORKERS = 1 # Processes used by the SimPy engine.  1 = run in-process, None = one per core
+            # (needs fork: on Windows the scenarios always run in-process)
+RESULTS_MEMMAP = None # Optional .npy file to hold the results buffer on disk, e.g. 'tanklevels.npy'
+TANKLEVEL_PERCENTILES = [5, 25, 50, 75, 95] # Percentiles reported for min water and for each month's tank level
+STREAMING_CHUNK_SIZE = 10000 # Scenarios simulated at a time by the streaming engine
+SAMPLE_PATHS = 20 # Trajectories kept for the time series graph
+
+# Sweep mode runs every combination of the lists below in one go (vectorized engine, same random draws for every cell)
+SWEEP = False
+SWEEP_CATCHMENT_SIZES = [3000, 30000] # Sq. Ft.
+SWEEP_TANK_SIZES = [25000, 250000] # Gallons
+SWEEP_CLIMATE_CHANGE_HAIRCUTS = [0, 0.2]
+SWEEP_FILENAME = 'sweep-results.csv'
+
+# First-passage mode only tracks when each scenario first runs dry, and stops simulating a scenario once it has
+FIRST_PASSAGE = False
+
+# Variance reduction for the failure probability estimate (vectorized engine)
+ANTITHETIC = False # Run scenarios in mirrored wet / dry pairs
+CONTROL_VARIATE = False # Adjust for how far each scenario's sampled inflow landed from its known mean
+
+# Importance sampling for configurations where failures are rare (e.g. 30k roof, 250k tank)
+IMPORTANCE_SAMPLING = False
+DROUGHT_TILT = None # Rainfall scale multiplier to sample with.  None = pick it with a cross-entropy pilot run
+if IMPORTANCE_SAMPLING and SEASONAL_RAINFALL:
+    # Checked here rather than when it gets to the importance sampling cell, after every other run
+    raise ValueError('IMPORTANCE_SAMPLING tilts the single fitted gamma, so it needs SEASONAL_RAINFALL = False')
 
 # Delivery agent will bring water every month
 # Retrieval agent will take water every month
 # The water tank is a storage facility
 
-def monthly_rain(name, env):
-    """ Every month a volume of rain falls.  The rain is put into the storage tank"""
-
-    rainfall_level_inches = random.gammavariate(shape, scale) * (1-CLIMATE_CHANGE_HAIRCUT)
-    rainfall_catchment_pct = random.randint(*CATCHMENT_EFFICIENCY) / 100
-    rainfall_capture_inches = rainfall_level_inches * rainfall_catchment_pct
-    rainfall_capture_cubicft = rainfall_capture_inches * CATCHMENT_SIZE / 12
-    rainfall_capture_gallons = rainfall_capture_cubicft * CUBIC_FT_TO_GAL
-#    print('Debug:')
-#    print('rainfall_level_inches: ', rainfall_level_inches)
-#    print('rainfall_catchment_pct: ', rainfall_catchment_pct)
-#    print('rainfall_capture_inches: ', rainfall_capture_inches)
-#    print('rainfall_capture_cubicft: ', rainfall_capture_cubicft)
-#    print('rainfall_capture_gallons: ', rainfall_capture_gallons)
-    tank_gap = water_tank.capacity - water_tank.level
-    amount = min(tank_gap, rainfall_capture_gallons) # This ensures the tank won't overflow
-    yield water_tank.put(amount)
-
-def monthly_watering(name, env):
-    water_used = random.randint(*WATER_USAGE)
-#    print('Water used: ', water_used)
-    yield water_tank.get(water_used)
-
-def month_control(env, water_tank):
-    while True:
-        """Drive the monthly process of triggering monthly rains and then triggering monthly crop watering"""
-#        print('Water in tank: ', water_tank.level, 'Calling rain and watering at %d' % env.now)
-        yield env.process(monthly_rain('Rain %d' % env.now, env))
-        yield env.process(monthly_watering('Water %d' % env.now, env))
-#        print('Finished rain and watering at %d' % env.now)
-#        print('Water left in the tank:', water_tank.level)
-        iter_tanklevel[env.now + 1] = water_tank.level
-        yield env.timeout(1)
-
-#%%
-df_tanklevel = pd.DataFrame()
-for i in range(1,ITERATIONS+1):
-
-    # Create environment and start processes
-    env = simpy.Environment()
-    #gas_station = simpy.Resource(env, 2)
-    #fuel_pump = simpy.Container(env, GAS_STATION_SIZE, init=GAS_STATION_SIZE)
-    water_tank = simpy.Container(env, WATER_TANK_SIZE, init = WATER_TANK_INIT)
-    env.process(month_control(env, water_tank))
-    #env.process(car_generator(env, gas_station, fuel_pump))
-
-    # Execute!
-    iter_tanklevel = []
-    iter_tanklevel = [0] * (DURATION+1)
-    iter_tanklevel[0] = WATER_TANK_INIT
-    env.run(until=DURATION)
-#    print('Scenario ran until: ', env.now)
-    col_name = 'Iter%d' % i
-    df_tanklevel[col_name] = iter_tanklevel
-    if i % 50 == 0:
-        print('On scenario # %d' % i)
-
-#%%
-df_minwater = pd.DataFrame()
-df_minwater['min'] = df_tanklevel.min()
-n_zeros = np.count_nonzero(df_minwater['min']==0)
+#%%
+# Each scenario is a self-contained SimPy run (see run_scenario in tank_simulation.py) with its own seed,
+# so the scenarios can be spread across a process pool.  WORKERS = 1 runs them one after another in-process
+# With SEASONAL_RAINFALL each month column of the CSV gets its own zero-inflated gamma, precomputed as an
+# inverse-CDF lookup table so every month of every scenario is sampled with one table lookup.  Month 0 is January
+rainfall_table = None
+if SEASONAL_RAINFALL:
+    monthly_rainfall = fit_monthly_rainfall(df_rainfall)
+    print(pd.DataFrame({'p_zero': monthly_rainfall.p_zero, 'shape': monthly_rainfall.shape,
+                        'scale': monthly_rainfall.scale}, index=monthly_rainfall.months))
+    rainfall_table = rainfall_lookup_table(monthly_rainfall)
+
+tank_params = TankParams(WATER_TANK_SIZE, WATER_TANK_INIT, CATCHMENT_EFFICIENCY, CATCHMENT_SIZE,
+                         CUBIC_FT_TO_GAL, WATER_USAGE, DURATION, CLIMATE_CHANGE_HAIRCUT, shape, scale, rainfall_table)
+# Results go into a preallocated (DURATION+1, ITERATIONS) float32 buffer rather than growing a DataFrame
+# one column at a time.  Set RESULTS_MEMMAP to back the buffer with a file for very large runs
+if ENGINE == 'simpy' or CHECK_ENGINE:
+    tanklevels_simpy = run_scenarios(tank_params, ITERATIONS, seed, WORKERS,
+                                     RESULTS_MEMMAP if ENGINE == 'simpy' else None)
+
+#%%
+# Vectorized engine: every scenario's rainfall, catchment and usage are drawn up front and all of the tanks
+# are walked forward together.  The SimPy engine above stays as the reference implementation
+if ENGINE == 'numpy' or CHECK_ENGINE:
+    tanklevels_numpy = simulate_tanklevels(tank_params, ITERATIONS, seed, RESULTS_MEMMAP if ENGINE == 'numpy' else None)
+    if CHECK_ENGINE:
+        print('SimPy vs NumPy engine: ', compare_min_water(tanklevels_simpy.min(axis=0), tanklevels_numpy.min(axis=0)))
+
+#%%
+# Streaming engine: the trajectories are never all kept.  Each chunk of scenarios is folded into running per-month
+# mean / variance, per-month level histograms (the quantile sketch), a min water histogram and the first
+# SAMPLE_PATHS trajectories, so memory stays flat no matter how big ITERATIONS gets
+if ENGINE == 'streaming':
+    tank_stats = simulate_streaming(tank_params, ITERATIONS, seed, STREAMING_CHUNK_SIZE, SAMPLE_PATHS)
+
+#%%
+# Min water, failure count and percentiles all come straight off the buffer (or the streaming statistics).
+# The buffer is only wrapped as a DataFrame (without copying) at the end, for the plots
+if ENGINE == 'streaming':
+    tank_summary = tank_stats.summarize(TANKLEVEL_PERCENTILES)
+    df_tanklevel = pd.DataFrame(tank_stats.sample_paths, columns=['Iter%d' % i for i in range(1, tank_stats.sample_paths.shape[1]+1)])
+else:
+    tanklevels = tanklevels_simpy if ENGINE == 'simpy' else tanklevels_numpy
+    iter_columns = ['Iter%d' % i for i in range(1, ITERATIONS+1)]
+    tank_summary = summarize_tanklevels(tanklevels, TANKLEVEL_PERCENTILES)
+    df_minwater = pd.DataFrame({'min': tank_summary.min_water}, index=iter_columns)
+    df_tanklevel = pd.DataFrame(tanklevels, columns=iter_columns, copy=False)
+n_zeros = tank_summary.n_zeros
 print('# iterations where we ran out of water: ',n_zeros)
+print('Min water percentiles', dict(zip(TANKLEVEL_PERCENTILES, tank_summary.min_water_percentiles.round().tolist())))
+df_tanklevel_pct = pd.DataFrame(tank_summary.monthly_percentiles.T, columns=['P%d' % p for p in TANKLEVEL_PERCENTILES])
 
 #%%
 
 # Code below creates a histogram of end-states
 
-mw_hist = df_minwater.plot.hist(bins=20, density=True, alpha=0.6, color='b')
+if ENGINE == 'streaming':
+    # Same 20-bin density histogram, regrouped from the streaming min water histogram (empty tanks go in the first bin)
+    mw_counts = tank_stats.min_water_hist.reshape(20, -1).sum(axis=1)
+    mw_counts[0] += tank_stats.min_water_zeros
+    mw_edges = tank_stats.bin_edges[::len(tank_stats.bin_edges) // 20]
+    plt.bar(mw_edges[:-1], mw_counts / mw_counts.sum() / np.diff(mw_edges), width=np.diff(mw_edges), align='edge',
+            alpha=0.6, color='b', label='min')
+    plt.ylabel('Frequency')
+    plt.legend()
+else:
+    mw_hist = df_minwater.plot.hist(bins=20, density=True, alpha=0.6, color='b')
 plt.title('Histogram of min water per simulation.  %d scenarios fail' % n_zeros)
 fig = plt.gcf()
 filename = 'Graphs/MinWaterHistRoof{c}kTank{t}kCCHC{cchc}.png'.format(c=round(CATCHMENT_SIZE/1000), t=round(WATER_TANK_SIZE/1000), cchc=round(CLIMATE_CHANGE_HAIRCUT*100))
@@ -198,3 +233,53 @@ fig = plt.gcf()
 filename = 'Graphs/RainfallTSRoof{c}kTank{t}kCCHC{cchc}.png'.format(c=round(CATCHMENT_SIZE/1000), t=round(WATER_TANK_SIZE/1000), cchc=round(CLIMATE_CHANGE_HAIRCUT*100))
 fig.savefig(filename)
 plt.close()
+
+#%%
+
+# Sweep mode: failure probability and min water percentiles for every roof / tank / haircut combination.
+# Every cell reuses the same rainfall draws (common random numbers), so the cells can be compared head to head
+if SWEEP:
+    df_sweep = sweep_grid(tank_params, ITERATIONS, SWEEP_CATCHMENT_SIZES, SWEEP_TANK_SIZES,
+                          SWEEP_CLIMATE_CHANGE_HAIRCUTS, seed, TANKLEVEL_PERCENTILES)
+    df_sweep.to_csv(SWEEP_FILENAME, index=False)
+    print(df_sweep)
+
+
+#%%
+
+# First-passage mode: month of first depletion per scenario, and the survival curve of time-to-first-empty
+if FIRST_PASSAGE:
+    first_empty = first_passage_times(tank_params, ITERATIONS, seed)
+    n_empty = np.count_nonzero(first_empty != NEVER_EMPTY)
+    print('# iterations where we ran out of water: ', n_empty)
+    if n_empty > 0:
+        print('Median month of first empty (failed scenarios only): ', np.median(first_empty[first_empty != NEVER_EMPTY]))
+
+    df_survival = pd.DataFrame({'survival': survival_curve(first_empty, DURATION)})
+    df_survival.plot(legend=False, drawstyle='steps-post')
+    plt.title('Share of scenarios with water left, by month.  %d of %d scenarios fail' % (n_empty, ITERATIONS))
+    plt.xlabel('Month')
+    plt.ylim(0, 1.05)
+    fig = plt.gcf()
+    filename = 'Graphs/SurvivalRoof{c}kTank{t}kCCHC{cchc}.png'.format(c=round(CATCHMENT_SIZE/1000), t=round(WATER_TANK_SIZE/1000), cchc=round(CLIMATE_CHANGE_HAIRCUT*100))
+    fig.savefig(filename)
+    plt.close()
+
+#%%
+
+# Failure probability with its standard error, using antithetic pairs and / or control variates.
+# Effective sample size = how many plain Monte Carlo scenarios it would take to get the same standard error
+if ANTITHETIC or CONTROL_VARIATE:
+    fail_estimate = estimate_failure_probability(tank_params, ITERATIONS, seed, ANTITHETIC, CONTROL_VARIATE)
+    print('Failure probability: %.4f (std error %.4f, effective sample size %d from %d scenarios)'
+          % (fail_estimate.fail_pct, fail_estimate.std_error, fail_estimate.effective_sample_size, fail_estimate.iterations))
+
+#%%
+
+# Importance sampling: rainfall is drawn from a drier gamma so failures actually show up, and each failure is
+# reweighted by how likely its rainfall was under the fitted gamma.  Gives an unbiased estimate with confidence
+# bounds even when plain Monte Carlo reports "0 scenarios fail"
+if IMPORTANCE_SAMPLING:
+    is_estimate = estimate_failure_probability_importance(tank_params, ITERATIONS, seed, DROUGHT_TILT)
+    print('Failure probability (importance sampling, rainfall tilt %.3f): %.3g (95%% CI %.3g - %.3g, %d tilted failures)'
+          % (is_estimate.tilt, is_estimate.fail_pct, is_estimate.ci_low, is_estimate.ci_high, is_estimate.n_failures))